@@ -164,6 +164,18 @@ stickyProps = [
     [ 'gpudevices', False]
 ]
 
+# Settings whose gadgets are newer than some repositories' SubmitHoudiniToDeadline.ui. They are read from the dialog
+# when it has them, and submitted with these defaults when it doesn't.
+optionalProps = [
+    # [ propertyName, isThePropertyAnInteger, defaultValue ]
+    [ 'adaptivechunksize', True, 0 ],
+    [ 'localexportprocesses', True, 0 ],
+    [ 'reuseexports', True, 0 ],
+    [ 'frameorder', False, 'linear' ],
+    # opt-in, regions sized from the ROP's tile costs replace the tile grid the artist set up
+    [ 'autotileregions', True, 0 ],
+]
+
 submissionInfo = None
 maxPriority = 0
 homeDir = ""
@@ -181,6 +193,28 @@ valuesToToggle = {
     "vray" : []
 }
 
+def HasValue( dialog, propertyName ):
+    """
+    :param dialog: The UI where the user enters values
+    :param propertyName: The name of a property in optionalProps
+    :return: Whether the dialog has a gadget for the property
+    """
+    try:
+        dialog.value( propertyName + ".val" )
+    except hou.OperationFailed:
+        return False
+    return True
+
+def GetOptionalValue( dialog, propertyName ):
+    """
+    :param dialog: The UI where the user enters values
+    :param propertyName: The name of a property in optionalProps
+    :return: The property's value in the dialog, or its default if the dialog has no gadget for it
+    """
+    if HasValue( dialog, propertyName ):
+        return dialog.value( propertyName + ".val" )
+    return next( default for name, _, default in optionalProps if name == propertyName )
+
 def SaveStickyProp( config, stickyProp ):
     global dialog
 
@@ -202,6 +236,9 @@ def WriteStickySettings():
 
         for stickyProp, _ in stickyProps:
             SaveStickyProp( config, stickyProp )
+        for optionalProp, _, _ in optionalProps:
+            if HasValue( dialog, optionalProp ):
+                SaveStickyProp( config, optionalProp )
 
         with open( configFile, "w" ) as fileHandle:
             config.write( fileHandle )
@@ -283,6 +320,9 @@ def ReadStickySettings():
             if config.has_section( "Sticky" ):
                 for stickyProp, isInt in stickyProps:
                     loadStickyProp( config, stickyProp, isInt )
+                for optionalProp, isInt, _ in optionalProps:
+                    if HasValue( dialog, optionalProp ):
+                        loadStickyProp( config, optionalProp, isInt )
     except:
         print( "Could not read sticky settings" )
         print( traceback.format_exc() )
@@ -427,6 +467,11 @@ def InitializeDialog():
     dialog.setValue( "submitscene.val", 0 )
     dialog.setValue( "isframedependent.val", 1 )
     dialog.setValue( "framespertask.val", 1 )
+    if HasValue( dialog, "frameorder" ):
+        dialog.setMenuItems( "frameorder.val", [ "linear", "progressive" ] )
+    for optionalProp, _, default in optionalProps:
+        if HasValue( dialog, optionalProp ):
+            dialog.setValue( optionalProp + ".val", default )
     dialog.setMenuItems( "bits.val", ["None", "32bit", "64bit"] )
     dialog.setValue( "bits.val", bits )
     dialog.setValue( "separateWedgeJobs.val", 0 )
@@ -973,6 +1018,8 @@ def TilesEnabledCallback():
 
     dialog.enableValue( "tilessingleframeenabled.val", tilesEnabled )
     dialog.enableValue( "submitdependentassembly.val", tilesEnabled )
+    if HasValue( dialog, "autotileregions" ):
+        dialog.enableValue( "autotileregions.val", tilesEnabled )
     JigsawEnabledCallback()
     TilesSingleFrameEnabledCallback()
     SubmitDependentAssemblyCallback()
@@ -1109,9 +1156,13 @@ def GetJobProperties( dialog, groupBatch=None, jigsawRegionCount=None, jigsawReg
         "overrideframes" : dialog.value( "overrideframes.val" ),
         "framelist" : dialog.value( "framelist.val" ),
         "framespertask" : dialog.value( "framespertask.val" ),
+        "adaptivechunksize" : GetOptionalValue( dialog, "adaptivechunksize" ),
+        "frameorder" : GetOptionalValue( dialog, "frameorder" ),
         "bits" : dialog.value( "bits.val" ),
         "submitscene" : dialog.value( "submitscene.val" ),
         "isframedependent": dialog.value( "isframedependent.val" ),
+        "localexportprocesses" : GetOptionalValue( dialog, "localexportprocesses" ),
+        "reuseexports" : GetOptionalValue( dialog, "reuseexports" ),
 
         "gpuopenclenable" : dialog.value( "gpuopenclenable.val" ),
         "gpuspertask" : int( dialog.value( "gpuspertask.val" ) ),
@@ -1214,6 +1265,7 @@ def GetJobProperties( dialog, groupBatch=None, jigsawRegionCount=None, jigsawReg
         "jigsawenabled": dialog.value( "jigsawenabled.val"),
         "jigsawregioncount": jigsawRegionCount,
         "jigsawregions": jigsawRegions,
+        "autotileregions": GetOptionalValue( dialog, "autotileregions" ),
         
         "submitdependentassembly": dialog.value( "submitdependentassembly.val"),
 
@@ -1334,6 +1386,11 @@ def SubmitRenderJob( job, jobOrdering, batch, jigsawRegionCount, jigsawRegions )
         jobOrdering[job][0] = ",".join(jobIds)
 
 def SubmitJobCallback():
+    # Everything evaluated while validating and submitting is memoized until the submission ends
+    with SHTDFunctions.submission_cache():
+        SubmitJobs()
+
+def SubmitJobs():
     global dialog, homeDir, jigsawThread, submissionInfo
     jobs = []
     submissions = []
@@ -1417,13 +1474,16 @@ def SubmitJobCallback():
     vrayExportWillOverwrite = ""
     vrayDoubleRender = ""
 
+    # Evaluate every ROP's paths up front, switching takes once per take rather than once per ROP
+    SHTDFunctions.evaluate_paths_by_take( [ hou.node( node ) for node in jobs ] )
+
     # check if the nodes are outputing to local
     for node in jobs:
-        outputPath = SHTDFunctions.GetOutputPath( hou.node( node ) )
+        renderNode = hou.node( node )
+        outputPath, outputFile, _ = SHTDFunctions.get_render_output_filepath( renderNode )
         if outputPath and outputPath != "COMMAND":
-            if SHTDFunctions.IsPathLocal( outputPath.eval() ):
+            if SHTDFunctions.IsPathLocal( outputFile ):
                 localPaths += "  %s  (output file)\n" % node
-        renderNode = hou.node( node )
 
         if dialog.value( "tilesenabled.val" ) == 1:
             if dialog.value( "tilessingleframeenabled.val" ) != 1:
@@ -1448,7 +1508,7 @@ def SubmitJobCallback():
         isVRay = SHTDFunctions.is_vray_renderer_node( renderNode )
 
         if ifdPath != None:
-            if SHTDFunctions.IsPathLocal( ifdPath.eval() ):
+            if SHTDFunctions.IsPathLocal( SHTDFunctions.get_standalone_export_path( renderNode )[0] ):
                 localPaths += "  %s  (disk file)\n" % node
 
             if dialog.value( "mantrajob.val" ) == 1 and dialog.value( "mantralocalexport.val" ) != 1 and isMantra:
@@ -1486,12 +1546,22 @@ def SubmitJobCallback():
             if SHTDFunctions.export_will_overwrite( renderNode, GetJobProperties( dialog ) ):
                 vrayExportWillOverwrite += " %s \n" % renderNode.path()
 
-    
+    # Check if several ROPs will write the same output files
+    outputCollisions = ""
+    try:
+        outputCollisions = SHTDFunctions.describe_output_collisions( SHTDFunctions.find_output_collisions( [ hou.node( node ) for node in jobs ], GetJobProperties( dialog ) ) )
+    except:
+        print( "Could not check ROPs for output collisions" )
+        print( traceback.format_exc() )
+
     warningMessage = []
 
     if localPaths != "":
         warningMessage.append( "The following ROPs have local output/disk paths: \n\n%s\n" % localPaths )
 
+    if outputCollisions != "":
+        warningMessage.append( "The following output files will be written by more than one ROP: \n\n%s\n" % outputCollisions )
+
     if missingIFDPaths != "" and dialog.value( "mantrajob.val" ):
         warningMessage.append( "The Dependent Mantra Standalone job option is enabled, but the following ROPs don't have the Disk File option enabled to export IFD files: \n\n%s\n" % missingIFDPaths )
 
@@ -1527,14 +1597,16 @@ def SubmitJobCallback():
     WriteStickySettings()
     SaveSceneFields()
 
-    for job in jobs:
-        # Wedge nodes can have additional jobs submitted
-        renderNode = hou.node( job )
-        isWedge = renderNode.type().description() == "Wedge"
-        if isWedge and dialog.value( "separateWedgeJobs.val" ):
-            totalJobs += SHTDFunctions.WedgeTasks( renderNode ) - 1
+    # Jobs are submitted grouped by take so each take is switched to once, dependencies are still submitted first
+    with SHTDFunctions.grouped_take_switches():
+        for renderNode in SHTDFunctions.order_by_take( [ hou.node( job ) for job in jobs ] ):
+            job = renderNode.path()
+            # Wedge nodes can have additional jobs submitted
+            isWedge = renderNode.type().description() == "Wedge"
+            if isWedge and dialog.value( "separateWedgeJobs.val" ):
+                totalJobs += SHTDFunctions.WedgeTasks( renderNode ) - 1
 
-        SubmitRenderJob(job, jobOrdering, (totalJobs > 1), jigsawRegionCount, jigsawRegions )
+            SubmitRenderJob(job, jobOrdering, (totalJobs > 1), jigsawRegionCount, jigsawRegions )
 
     if totalJobs > 1:
         dialog.setValue( "status.val", "100%: All " + str( totalJobs ) + " jobs submitted" )
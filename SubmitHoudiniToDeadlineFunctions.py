@@ -2,6 +2,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 
+import collections
+import contextlib
+import functools
+import hashlib
 import json
 import os
 import re
@@ -12,6 +16,262 @@ import time
 import hou
 
 PADDED_NUMBER_REGEX = re.compile( "([0-9]+)", re.IGNORECASE )
+# Matches Houdini's $F, $F4 and ${F4} frame variables, but not other variables starting with F like $FPS or $FEND
+FRAME_TOKEN_REGEX = re.compile( r"\$\{F([0-9]*)\}|\$F([0-9]*)(?![A-Za-z0-9_])" )
+# Matches Deadline's <_FRAME_> and <_FRAME4_> frame tokens, see to_deadline_frame_tokens
+DEADLINE_FRAME_TOKEN_REGEX = re.compile( r"<_FRAME([0-9]*)_>" )
+
+# Job properties which change how a node's frames and exports are resolved. Used to key memoized values
+# that take the job properties into account.
+FRAME_PROPERTY_NAMES = ( "overrideframes", "framelist" )
+EXPORT_PROPERTY_NAMES = FRAME_PROPERTY_NAMES + (
+    "mantrajob", "mantralocalexport",
+    "arnoldjob", "arnoldlocalexport",
+    "rendermanjob", "rendermanlocalexport",
+    "redshiftjob", "redshiftlocalexport",
+    "vrayjob", "vraylocalexport",
+)
+CHUNK_PROPERTY_NAMES = EXPORT_PROPERTY_NAMES + ( "framespertask", "tilesenabled", "tilessingleframeenabled", "adaptivechunksize", "chunktargetminutes", "maxframespertask" )
+
+class SubmissionCache( object ):
+    """
+    Memoizes node evaluations and values derived from them for the duration of a single submission.
+    Houdini parameter evaluation is slow and the same values are queried many times while validating and
+    writing out the job files, so everything is evaluated at most once until the submission ends.
+    """
+    def __init__( self ):
+        self.values = {}
+
+    def get( self, key, compute ):
+        try:
+            value = self.values[ key ]
+        except KeyError:
+            value = compute()
+            self.values[ key ] = value
+
+        return value
+
+_submissionCache = None
+_submissionCacheDepth = 0
+
+@contextlib.contextmanager
+def submission_cache():
+    """
+    Opens a submission scope. Nested scopes share the cache of the outermost one, which is dropped when it exits.
+    :return: the active SubmissionCache
+    """
+    global _submissionCache, _submissionCacheDepth
+
+    if _submissionCache is None:
+        _submissionCache = SubmissionCache()
+    _submissionCacheDepth += 1
+
+    try:
+        yield _submissionCache
+    finally:
+        _submissionCacheDepth -= 1
+        if _submissionCacheDepth == 0:
+            _submissionCache = None
+
+def submission_cached_value( key, compute ):
+    """
+    Returns the memoized value for key, computing it if needed. Outside of a submission scope nothing is cached.
+    :param key: A hashable key identifying the value
+    :param compute: A callable returning the value
+    :return: The (possibly memoized) value
+    """
+    if _submissionCache is None:
+        return compute()
+
+    return _submissionCache.get( key, compute )
+
+def submission_memoize( key_func ):
+    """
+    Decorator memoizing a function for the duration of a submission.
+    :param key_func: Called with the function's arguments, returns a hashable tuple identifying the call
+    """
+    def decorator( func ):
+        @functools.wraps( func )
+        def wrapper( *args ):
+            if _submissionCache is None:
+                return func( *args )
+            return _submissionCache.get( ( func.__name__, ) + key_func( *args ), lambda: func( *args ) )
+        return wrapper
+    return decorator
+
+def job_properties_key( jobProperties, names ):
+    return tuple( jobProperties.get( name ) for name in names )
+
+def node_key( node, *args ):
+    # The same ROP evaluates differently in different takes
+    return ( node.path(), get_evaluation_take_name( node ) )
+
+def node_job_frames_key( node, jobProperties ):
+    return node_key( node ) + job_properties_key( jobProperties, FRAME_PROPERTY_NAMES )
+
+def node_job_export_key( node, jobProperties ):
+    return node_key( node ) + job_properties_key( jobProperties, EXPORT_PROPERTY_NAMES )
+
+def node_job_chunk_key( node, jobProperties ):
+    return node_key( node ) + job_properties_key( jobProperties, CHUNK_PROPERTY_NAMES )
+
+def eval_parm( node, parmName, frame=None ):
+    """
+    Evaluates a parameter of a node, memoized for the duration of a submission.
+    :param node: The node owning the parameter
+    :param parmName: The name of the parameter
+    :param frame: The frame to evaluate at, or None to evaluate at the current frame
+    :return: The evaluated value, or None if the node has no such parameter
+    """
+    def compute():
+        parm = node.parm( parmName )
+        if parm is None:
+            return None
+        if frame is None:
+            return parm.eval()
+        return parm.evalAtFrame( frame )
+
+    return submission_cached_value( ( "eval_parm", ) + node_key( node ) + ( parmName, frame ), compute )
+
+def get_rop_take_name( node ):
+    """
+    :param node: A ROP node
+    :return: The name of the take the ROP renders in, or None if it renders in the current take
+    """
+    takeParm = node.parm( "take" )
+    if takeParm is None:
+        return None
+
+    takeName = takeParm.evalAsString()
+    if takeName in ( "", "_current_" ):
+        return None
+
+    return takeName
+
+def find_take( takeName ):
+    """
+    :param takeName: The name of a take, or None for the current take
+    :return: The take, or None if it doesn't exist or takes aren't available
+    """
+    if takeName is None:
+        return None
+
+    try:
+        return hou.takes.findTake( takeName )
+    except AttributeError:
+        # hou object doesn't always have the 'takes' attribute
+        return None
+
+def get_current_take():
+    """
+    :return: The current take, or None if takes aren't available
+    """
+    try:
+        return hou.takes.currentTake()
+    except AttributeError:
+        # hou object doesn't always have the 'takes' attribute
+        return None
+
+# The take that was current when ROPs started being gone over grouped by take, see grouped_take_switches()
+_groupedOriginalTake = None
+
+def get_evaluation_take_name( node ):
+    """
+    Resolved once per ROP for the duration of a submission.
+    :param node: A ROP node
+    :return: The name of the take the ROP's parameters are evaluated in: its own take if it has one, otherwise the
+             current take, or None if takes aren't available
+    """
+    def compute():
+        takeName = get_rop_take_name( node )
+        if find_take( takeName ) is not None:
+            return takeName
+
+        currentTake = _groupedOriginalTake or get_current_take()
+        return currentTake.name() if currentTake is not None else None
+
+    return submission_cached_value( ( "get_evaluation_take_name", node.path() ), compute )
+
+@contextlib.contextmanager
+def grouped_take_switches():
+    """
+    While going over ROPs grouped by take, the take a ROP is evaluated in is left current for the ROPs after it
+    instead of being switched back, so each take is switched to only once. The original take is restored at the end.
+    """
+    global _groupedOriginalTake
+
+    if _groupedOriginalTake is not None:
+        yield
+        return
+
+    originalTake = get_current_take()
+    _groupedOriginalTake = originalTake
+    try:
+        yield
+    finally:
+        _groupedOriginalTake = None
+        if originalTake is not None and hou.takes.currentTake() != originalTake:
+            hou.takes.setCurrentTake( originalTake )
+
+@contextlib.contextmanager
+def rop_take( node ):
+    """
+    Makes the take a ROP is evaluated in current while its parameters are evaluated, and restores the previous take
+    afterwards unless inside grouped_take_switches(). Nothing is switched when the take is already current.
+    :param node: The ROP whose take should be used
+    """
+    take = find_take( get_evaluation_take_name( node ) )
+    previousTake = hou.takes.currentTake() if take is not None else None
+
+    if take is None or take == previousTake:
+        yield
+    elif _groupedOriginalTake is not None:
+        hou.takes.setCurrentTake( take )
+        yield
+    else:
+        hou.takes.setCurrentTake( take )
+        try:
+            yield
+        finally:
+            hou.takes.setCurrentTake( previousTake )
+
+def evaluate_in_rop_take( func ):
+    """
+    Decorator evaluating a function of a ROP node inside the take the ROP renders in.
+    """
+    @functools.wraps( func )
+    def wrapper( node, *args ):
+        with rop_take( node ):
+            return func( node, *args )
+    return wrapper
+
+def order_by_take( nodes ):
+    """
+    :param nodes: ROP nodes
+    :return: The nodes grouped by the take they're evaluated in, the ones in the current take first and otherwise in
+             their original order. Going over them inside grouped_take_switches() switches to each take only once.
+    """
+    currentTake = get_current_take()
+    takeOrder = { currentTake.name() if currentTake is not None else None: 0 }
+    for node in nodes:
+        takeOrder.setdefault( get_evaluation_take_name( node ), len( takeOrder ) )
+
+    return sorted( nodes, key=lambda node: takeOrder[ get_evaluation_take_name( node ) ] )
+
+def evaluate_paths_by_take( nodes ):
+    """
+    Evaluates the output and export paths of all of the given ROPs into the submission cache, grouping the ROPs by
+    take so each distinct take is switched to only once. Switching takes makes Houdini re-apply every take
+    override, so this is much cheaper than switching per ROP. The original take is restored afterwards.
+    Only useful inside a submission_cache() scope.
+    :param nodes: The ROP nodes which will be submitted
+    """
+    with grouped_take_switches():
+        for node in order_by_take( nodes ):
+            get_render_output_filepath( node )
+            get_standalone_export_path( node )
+            if node.type().description() in ( "RenderMan", "RenderMan RIS" ):
+                get_renderman_standalone_export_path( node )
 
 # TODO: This function is a duplicate from CallDeadlineCommand.py. Once we're a full major version
 # from Deadline 10 we can remove this since the client script will have the be updated.
@@ -75,6 +335,13 @@ def GetJobIdFromSubmission( submissionResults ):
 
     return jobId
 
+def GetSceneFile( jobProperties ):
+    """
+    :param jobProperties: The job's properties
+    :return: The scene the farm loads, a copy saved for the farm when the job has one, otherwise the current scene
+    """
+    return jobProperties.get( "scenefile" ) or hou.hipFile.path()
+
 def SaveScene():
     if hou.hipFile.hasUnsavedChanges():
         if hou.ui.displayMessage( "The scene has unsaved changes and must be saved before the job can be submitted.\nDo you wish to save?", buttons=( "Yes" , "No" ), title="Submit Houdini To Deadline" ) == 0:
@@ -84,6 +351,8 @@ def SaveScene():
 
     return True
 
+@submission_memoize( node_key )
+@evaluate_in_rop_take
 def GetOutputPath( node ):
     outputFile = ""
     nodeType = node.type().description()
@@ -147,19 +416,12 @@ def GetOutputPath( node ):
 
     return outputFile
 
+@submission_memoize( node_key )
+@evaluate_in_rop_take
 def GetExportPath( node ):
     ifdFile = None
     nodeType = node.type().description()
 
-    # Ensures the proper Take is selected for each ROP to retrieve the correct ifd
-    try:
-        ropTake = hou.takes.findTake( node.parm( "take" ).eval() )
-        if ropTake is not None:
-            hou.takes.setCurrentTake( ropTake )
-    except AttributeError:
-        # hou object doesn't always have the 'takes' attribute
-        pass
-
     if nodeType == "Mantra" and node.parm( "soho_outputmode" ).eval():
         ifdFile = node.parm( "soho_diskfile" )
     elif nodeType == "Alfred":
@@ -192,6 +454,7 @@ def NodeSupportsTiles( node ):
 
     return ( nodeType in supportedTypes )
 
+@evaluate_in_rop_take
 def WedgeTasks( wedgeNode ):
     numTasks = 1
     
@@ -298,6 +561,7 @@ def hqueueSliceCount( node ):
 
     return sliceCount
 
+@submission_memoize( node_key )
 def single_export_file( node ):
     """
     Checks export name at two different frames, and determine's whether they're the same
@@ -305,8 +569,9 @@ def single_export_file( node ):
     :param node: The render node, which has an export filepath
     :return: True if only one file will be exported (by default)
     """
-    return is_vray_renderer_node( node ) and node.parm("render_export_filepath").evalAtFrame(1) == node.parm("render_export_filepath").evalAtFrame(2)
+    return is_vray_renderer_node( node ) and eval_parm( node, "render_export_filepath", 1 ) == eval_parm( node, "render_export_filepath", 2 )
 
+@submission_memoize( node_job_export_key )
 def export_will_overwrite( node, jobProperties ):
     """
     Checks whether exports will overwrite when submitting an export job.  Currently only checks V-Ray
@@ -326,7 +591,7 @@ def export_will_overwrite( node, jobProperties ):
 
     localExport = isExportLocal( node, jobProperties )
     if localExport:
-        # When we override Frames and export is local, each render is done individually
+        # When we override Frames and export is local, a render is done per range of the frame list
         # If they have the same path (which we know they do at this point), they'll overwrite
         # When we don't override frames and the export is local, only a single render is done
         overrideFrames = jobProperties.get( "overrideframes", False )
@@ -338,6 +603,7 @@ def export_will_overwrite( node, jobProperties ):
         isContiguous = bool( re.match(r"^(-)?[0-9]*([-:](-)?[0-9]*)?$", frameList) )
         return not isContiguous
 
+@submission_memoize( node_job_frames_key )
 def GetFrameList( node, jobProperties ):
     """
     Parses a frame list either from the given render node or from the job properties, if an override is present
@@ -346,9 +612,21 @@ def GetFrameList( node, jobProperties ):
     :return: The framelist, parsed by Deadline Command so it can be submitted as part of a job
     """
     frameList = jobProperties.get( "framelist","0" ) if jobProperties.get( "overrideframes", False ) else GetFrameInfo( node )
-    frameList = CallDeadlineCommand( [ "-ParseFrameList", frameList, "True" ] ).strip()
+    frameList = ParseFrameList( frameList, True )
     return frameList
 
+def ParseFrameList( frameList, collapse ):
+    """
+    Parses a frame list with Deadline Command, memoized for the duration of a submission
+    :param frameList: The frame list to parse
+    :param collapse: Whether Deadline should collapse the frames back into ranges, or list every frame
+    :return: The parsed frame list
+    """
+    collapseArg = "True" if collapse else "False"
+    return submission_cached_value( ( "ParseFrameList", frameList, collapseArg ),
+        lambda: CallDeadlineCommand( [ "-ParseFrameList", frameList, collapseArg ] ).strip() )
+
+@submission_memoize( node_key )
 def GetFrameInfo( renderNode ):
     startFrame = 0
     endFrame = 0
@@ -381,8 +659,76 @@ def GetFrameInfo( renderNode ):
 
     return frameString
 
-def RightReplace( fullString, oldString, newString, occurences ):
-    return newString.join( fullString.rsplit( oldString, occurences ) )
+class OutputPathPattern( object ):
+    """
+    An output path split around its frame number, which is the last number in the file name.
+    The path is scanned once, after which every form of it the job files need (Deadline padding, concrete frames,
+    tile names, globs) is built by plain string concatenation.
+    """
+    def __init__( self, path ):
+        self.path = path
+        self.hasFrame = False
+        self.prefix = path
+        self.suffix = ""
+        self.padding = 0
+
+        fileName = os.path.basename( path )
+        matches = list( PADDED_NUMBER_REGEX.finditer( fileName ) )
+        if matches:
+            match = matches[ -1 ]
+            start = len( path ) - len( fileName ) + match.start()
+            end = len( path ) - len( fileName ) + match.end()
+            self.hasFrame = True
+            self.prefix = path[ :start ]
+            self.suffix = path[ end: ]
+            self.padding = end - start
+
+        self.root, self.ext = os.path.splitext( path )
+
+    def padded( self, paddingChar="#" ):
+        """
+        :param paddingChar: The character to pad with, ie. '#' for Deadline style padding or '0'
+        :return: The path with its frame number replaced by padding, or the path itself if it has no frame number
+        """
+        if not self.hasFrame:
+            return self.path
+        return self.prefix + paddingChar * self.padding + self.suffix
+
+    def frame_string( self, frame ):
+        return str( frame ).zfill( self.padding )
+
+    def frame( self, frame ):
+        """
+        :return: The path for a concrete frame, or the path itself if it has no frame number
+        """
+        if not self.hasFrame:
+            return self.path
+        return self.prefix + self.frame_string( frame ) + self.suffix
+
+    def tile( self, tile, frame ):
+        """
+        :param tile: The tile number, or a placeholder such as '?' to be replaced later
+        :param frame: The frame rendered
+        :return: The path of a tile of the given frame, as written by tile renders
+        """
+        if not self.hasFrame:
+            return self.root + "_tile" + str( tile ) + "_" + self.ext
+        return self.prefix + "_tile" + str( tile ) + "_" + self.frame_string( frame ) + self.suffix
+
+    def glob( self ):
+        """
+        :return: A glob pattern matching the path at any frame
+        """
+        if not self.hasFrame:
+            return self.path
+        return self.prefix + "[0-9]" * self.padding + "*" + self.suffix
+
+def get_path_pattern( path ):
+    """
+    :param path: An evaluated output path
+    :return: The path's OutputPathPattern, parsed once per submission
+    """
+    return submission_cached_value( ( "OutputPathPattern", path ), lambda: OutputPathPattern( path ) )
 
 def ConcatenatePipelineToolSettingsToJob( jobInfoPath, batchName ):
     """
@@ -450,18 +796,19 @@ def file_should_be_precached(file_parm, files_to_ignore=()):
     return True
 
 
-def get_asset_paths_to_precache(scene_file_is_aux, files_to_ignore=()):
+def get_asset_paths_to_precache(scene_file_is_aux, files_to_ignore=(), scene_file=None):
     """
     Get the full paths of files to pre-cache. If the Houdini scene file isn't submitted with the job it will be added as
     an asset to pre-cache.
     :param scene_file_is_aux: Whether or not the Houdini scene file is an auxiliary file/submitted with the job.
     :param files_to_ignore: A set or tuple of files to be ignored for pre-caching
+    :param scene_file: The Houdini scene file the job loads, the current scene if not given.
     :return: A list of asset paths to be pre-cached.
     """
     asset_paths_to_precache = []
 
     if not scene_file_is_aux:
-        asset_paths_to_precache.append(hou.hipFile.path())
+        asset_paths_to_precache.append(scene_file or hou.hipFile.path())
 
     for file_reference_parm, _ in hou.fileReferences():
         if file_should_be_precached(file_reference_parm, files_to_ignore=files_to_ignore):
@@ -490,6 +837,8 @@ def write_asset_paths_to_job_file(asset_paths, job_file):
         job_file.write("AWSAssetFile{0}={1}\n".format(index, asset_path))
 
 
+@submission_memoize( node_key )
+@evaluate_in_rop_take
 def get_render_output_filepath(node):
     """
     This function gets the output path for a given node,
@@ -506,12 +855,10 @@ def get_render_output_filepath(node):
     paddedOutputFile = ""
     if output and output != "COMMAND":
         outputFile = output.eval()
-        matches = PADDED_NUMBER_REGEX.findall( os.path.basename( outputFile ) )
-        if matches != None and len( matches ) > 0:
-            paddingString = matches[ len( matches ) - 1 ]
-            paddingSize = len( paddingString )
-            padding = "#" * paddingSize if paddingSize else "#"
-            paddedOutputFile = RightReplace( outputFile, paddingString, padding, 1 )
+        paddedOutputFile = pad_frame_tokens( get_frame_templated_path( output ), "#" )
+        if paddedOutputFile == outputFile:
+            # The output doesn't change with the frame
+            paddedOutputFile = ""
     elif output is None and node.type().description() == "RenderMan":
         print( 'Warning: RenderMan 21 has deprecated the "RenderMan" node, please use the newer "RenderMan RIS" node.' )
     elif output != "COMMAND":
@@ -528,6 +875,8 @@ def get_render_output_filepath(node):
     return output, outputFile, paddedOutputFile
 
 
+@submission_memoize( node_key )
+@evaluate_in_rop_take
 def get_standalone_export_path(node):
     """
     Provides the exported file's path as an export path and a padded filepath
@@ -543,17 +892,98 @@ def get_standalone_export_path(node):
     paddedExportFile = ""
     if exportFileParameter != None:
         exportFile = exportFileParameter.eval()
-        matches = PADDED_NUMBER_REGEX.findall( os.path.basename( exportFile ) )
-        if matches != None and len( matches ) > 0:
-            paddingString = matches[ len( matches ) - 1 ]
-            paddingSize = len( paddingString )
-            padding = "0".zfill(paddingSize)
-            paddedExportFile = RightReplace( exportFile, paddingString, padding, 1 )
-        else:
-            paddedExportFile = exportFile
+        paddedExportFile = pad_frame_tokens( get_frame_templated_path( exportFileParameter ), "0" )
 
     return exportFile, paddedExportFile
 
+def expand_string_for_node( node, unexpanded, frame=None ):
+    """
+    Expands variables and expressions in a string as if it were a parameter value of the given node,
+    so node relative variables like $OS resolve correctly. The node itself is not modified.
+    :param node: The node to expand relative to
+    :param unexpanded: The string to expand
+    :param frame: The frame to expand at, or None to expand at the current frame
+    :return: The expanded string
+    """
+    previousPwd = hou.pwd()
+    hou.setPwd( node )
+    try:
+        if frame is None:
+            return hou.expandString( unexpanded )
+        return hou.expandStringAtFrame( unexpanded, frame )
+    finally:
+        hou.setPwd( previousPwd )
+
+def to_deadline_frame_tokens( unexpanded ):
+    """
+    Replaces the $F, $F<n> and ${F<n>} tokens of an unexpanded Houdini string with Deadline's <_FRAME<n>_> token.
+    Tokens inside backtick expressions can't be replaced and are left for Houdini to evaluate.
+    :param unexpanded: The unexpanded string
+    :return: The string with Deadline frame tokens
+    """
+    def deadline_token( match ):
+        padding = match.group( 1 ) if match.group( 1 ) is not None else match.group( 2 )
+        return "<_FRAME" + padding + "_>"
+
+    # Even sections are plain text, odd sections are inside backticks
+    sections = unexpanded.split( "`" )
+    for index in range( 0, len( sections ), 2 ):
+        sections[ index ] = FRAME_TOKEN_REGEX.sub( deadline_token, sections[ index ] )
+
+    for index in range( 1, len( sections ), 2 ):
+        if FRAME_TOKEN_REGEX.search( sections[ index ] ):
+            print( 'Warning: frame variables inside the expression "`%s`" are evaluated at the current frame.' % sections[ index ] )
+
+    return "`".join( sections )
+
+def expand_frame_templated_parm( parm ):
+    """
+    Evaluates a file parameter, expanding every variable except the frame number, which is replaced with
+    Deadline's frame token. Unlike setting the parameter to a tokenized value and evaluating it, this has no
+    side effects on the scene: it isn't marked as modified, callbacks don't run and nothing recooks.
+    :param parm: The file parameter
+    :return: The evaluated path containing Deadline frame tokens
+    """
+    try:
+        unexpanded = parm.unexpandedString()
+    except hou.OperationFailed:
+        # Keyframed parameters can't be unexpanded, so they can only be evaluated at the current frame.
+        return parm.eval()
+
+    return expand_string_for_node( parm.node(), to_deadline_frame_tokens( unexpanded ) )
+
+def get_frame_templated_path( parm ):
+    """
+    :param parm: A file parameter
+    :return: The parameter's evaluated path with its frame numbers as Deadline frame tokens. Paths which only change
+             with the frame through expressions get a token for the last number in their file name, paths which
+             don't change with the frame get none.
+    """
+    path = expand_frame_templated_parm( parm )
+    if DEADLINE_FRAME_TOKEN_REGEX.search( path ) or not parm.isTimeDependent():
+        return path
+
+    pattern = get_path_pattern( parm.eval() )
+    if not pattern.hasFrame:
+        return pattern.path
+    return pattern.prefix + "<_FRAME%s_>" % pattern.padding + pattern.suffix
+
+def pad_frame_tokens( templatedPath, paddingChar ):
+    """
+    :param templatedPath: A path with Deadline frame tokens
+    :param paddingChar: The character to pad with, ie. '#' for Deadline style padding or '0'
+    :return: The path with each frame token replaced by padding
+    """
+    return DEADLINE_FRAME_TOKEN_REGEX.sub( lambda match: paddingChar * max( int( match.group( 1 ) or 0 ), 1 ), templatedPath )
+
+def expand_frame_tokens( templatedPath, frame ):
+    """
+    :return: The path of a concrete frame of a path with Deadline frame tokens
+    """
+    return DEADLINE_FRAME_TOKEN_REGEX.sub( lambda match: str( frame ).zfill( int( match.group( 1 ) or 0 ) ), templatedPath )
+
+@submission_memoize( node_key )
+@evaluate_in_rop_take
 def get_renderman_standalone_export_path(node):
     """
     Provides the exported file's path for RenderMan.
@@ -565,28 +995,11 @@ def get_renderman_standalone_export_path(node):
     export_file_parameter = GetExportPath( node )
     export_file = ''
     if export_file_parameter != None:
-        original_unexpended = export_file_parameter.unexpandedString()
-        unexpended = original_unexpended
-
-        FRAME_TOKEN_REGEX = re.compile( '(\$F([0-9]*))' )
-        matches = FRAME_TOKEN_REGEX.findall( unexpended )
-        for match in matches:
-            houdini_token = match[0]
-            padding_size = ''
-            if len(match) > 1 and match[1] != '':
-                padding_size = match[1]
-
-            deadline_token = '<_FRAME' + padding_size + '_>'
-            unexpended = unexpended.replace(houdini_token, deadline_token)
-
-        export_file_parameter.set(unexpended)
-        export_file = export_file_parameter.eval()
-
-        # Set the parameter value back to original value, so we don't modify the scene.
-        export_file_parameter.set(original_unexpended)
+        export_file = expand_frame_templated_parm( export_file_parameter )
 
     return export_file
 
+@submission_memoize( node_job_chunk_key )
 def determine_chunk_size(node, jobProperties):
     """
     Given a node and job properties get the chunk size for the job.
@@ -617,9 +1030,559 @@ def determine_chunk_size(node, jobProperties):
         NodeSupportsTiles(node) and isExportJob( node, jobProperties ):
             return 1
 
+    if jobProperties.get( "adaptivechunksize", False ):
+        adaptiveChunkSize = get_adaptive_chunk_size( node, jobProperties )
+        if adaptiveChunkSize:
+            return adaptiveChunkSize
+
     return jobProperties.get( "framespertask", 1 )
 
+def get_adaptive_chunk_size( node, jobProperties ):
+    """
+    Recommends a chunk size from how long the tasks of the ROP's previous jobs took, see task_history.
+    :param node: The node to be rendered
+    :param jobProperties: The current job's properties, which may have a ( minimum, maximum ) "chunktargetminutes"
+        and a "maxframespertask" the recommendation is capped at
+    :return: The recommended chunk size, or None if there is no history for the ROP yet
+    """
+    try:
+        import task_history
+    except ImportError:
+        return None
+
+    frameCount = count_frame_ranges( parse_frame_ranges( GetFrameList( node, jobProperties ) ) )
+    targetMinutes = jobProperties.get( "chunktargetminutes", task_history.DEFAULT_TARGET_MINUTES )
+
+    try:
+        chunkSize = task_history.recommend_chunk_size( hou.hipFile.path(), node.path(), node.type().name(), frameCount, targetMinutes )
+    except Exception as e:
+        print( "Unable to recommend a chunk size from the task history: %s" % e )
+        return None
+
+    maxChunkSize = int( jobProperties.get( "maxframespertask", 0 ) )
+    if chunkSize and maxChunkSize:
+        chunkSize = min( chunkSize, maxChunkSize )
+    return chunkSize
+
+def record_submitted_job( jobId, node ):
+    """
+    Remembers a submitted job so its task timings are added to the task history once it has finished.
+    """
+    try:
+        import task_history
+        task_history.record_job( jobId, hou.hipFile.path(), node.path(), node.type().name() )
+    except ImportError:
+        pass
+    except Exception as e:
+        print( "Unable to record job %s in the task history: %s" % ( jobId, e ) )
 
+
+FRAME_RANGE_REGEX = re.compile( r"^(-?[0-9]+)(?:[-:](-?[0-9]+)(?:[x:](-?[0-9]+))?)?$" )
+
+def parse_frame_ranges( frameList ):
+    """
+    Parses a Deadline style frame list, ie. "1-100x2,105,110-120", into (start, end, step) ranges without
+    expanding every frame or calling Deadline Command.
+    :param frameList: The frame list
+    :return: A list of (start, end, step) tuples, where end is inclusive
+    """
+    frameRanges = []
+    for section in frameList.replace( " ", "," ).split( "," ):
+        if not section:
+            continue
+
+        match = FRAME_RANGE_REGEX.match( section )
+        if match is None:
+            raise ValueError( "Invalid frame list: %s" % frameList )
+
+        start = int( match.group( 1 ) )
+        end = int( match.group( 2 ) ) if match.group( 2 ) is not None else start
+        step = abs( int( match.group( 3 ) ) ) if match.group( 3 ) else 1
+        if end < start:
+            step = -step
+        frameRanges.append( ( start, end, step or 1 ) )
+
+    return frameRanges
+
+def count_frame_ranges( frameRanges ):
+    return sum( abs( end - start ) // abs( step ) + 1 for start, end, step in frameRanges )
+
+def iter_frame_ranges( frameRanges ):
+    for start, end, step in frameRanges:
+        for frame in range( start, end + ( 1 if step > 0 else -1 ), step ):
+            yield frame
+
+def frame_bounds_overlap( frameRangeLists ):
+    """
+    :param frameRangeLists: Lists of (start, end, step) ranges
+    :return: Whether the first to last frame bounds of any two of the lists overlap
+    """
+    bounds = []
+    for frameRanges in frameRangeLists:
+        if frameRanges:
+            bounds.append( ( min( min( start, end ) for start, end, _ in frameRanges ), max( max( start, end ) for start, end, _ in frameRanges ) ) )
+
+    bounds.sort()
+    for index in range( 1, len( bounds ) ):
+        if bounds[ index ][ 0 ] <= bounds[ index - 1 ][ 1 ]:
+            return True
+
+    return False
+
+def format_frames( frames ):
+    """
+    Collapses frames into a Deadline frame list, keeping their order, ie. [ 1, 2, 3, 7, 9, 11, 20 ] -> "1-3,7-11x2,20"
+    """
+    sections = []
+    index = 0
+    while index < len( frames ):
+        start = frames[ index ]
+        end = start
+        step = frames[ index + 1 ] - start if index + 1 < len( frames ) else 0
+        if step > 0:
+            while index + 1 < len( frames ) and frames[ index + 1 ] - frames[ index ] == step:
+                index += 1
+            end = frames[ index ]
+        index += 1
+
+        if end == start:
+            sections.append( str( start ) )
+        elif step == 1:
+            sections.append( "%s-%s" % ( start, end ) )
+        else:
+            sections.append( "%s-%sx%s" % ( start, end, step ) )
+
+    return ",".join( sections )
+
+def progressive_order( count ):
+    """
+    Orders the indices 0..count-1 first, last, middle and then by binary subdivision, so the start, end and an
+    ever finer sampling of a sequence come first.
+    :return: A list of every index in progressive order
+    """
+    if count <= 0:
+        return []
+
+    order = [ 0 ]
+    if count > 1:
+        order.append( count - 1 )
+
+    intervals = collections.deque( [ ( 0, count - 1 ) ] )
+    while intervals:
+        low, high = intervals.popleft()
+        if high - low < 2:
+            continue
+
+        middle = ( low + high ) // 2
+        order.append( middle )
+        intervals.append( ( low, middle ) )
+        intervals.append( ( middle, high ) )
+
+    return order
+
+def progressive_frame_list( frameList, chunkSize ):
+    """
+    Reorders a frame list so problems show up early on long ranges: the chunks of the first, last and middle frames
+    render first, followed by a binary subdivision of the rest. Every task still renders contiguous frames.
+    :param frameList: A Deadline frame list
+    :param chunkSize: The number of frames per task
+    :return: The reordered frame list
+    """
+    chunkSize = max( int( chunkSize ), 1 )
+    frames = list( iter_frame_ranges( parse_frame_ranges( frameList ) ) )
+    # Deadline splits the list into chunks in order, so a short chunk anywhere but the end would shift the chunks
+    # after it. The full chunks are taken from both ends of the range, so the first and last frames are in full
+    # chunks, and the short chunk of the frames left over in the middle goes last.
+    chunkCount = len( frames ) // chunkSize
+    if chunkCount < 2:
+        return frameList
+
+    headLength = ( chunkCount // 2 ) * chunkSize
+    tailStart = len( frames ) - ( chunkCount - chunkCount // 2 ) * chunkSize
+    starts = list( range( 0, headLength, chunkSize ) ) + list( range( tailStart, len( frames ), chunkSize ) )
+    chunks = [ frames[ start:start + chunkSize ] for start in starts ]
+
+    orderedChunks = [ chunks[ index ] for index in progressive_order( len( chunks ) ) ]
+    if headLength < tailStart:
+        orderedChunks.append( frames[ headLength:tailStart ] )
+
+    return ",".join( format_frames( chunk ) for chunk in orderedChunks )
+
+def get_submitted_frame_list( node, jobProperties, chunkSize ):
+    """
+    The frame list to write to a job file. Frames are in order unless the "frameorder" job property is
+    "progressive", see progressive_frame_list.
+    :param node: The render node to be rendered
+    :param jobProperties: The current job's properties
+    :param chunkSize: The number of frames per task
+    :return: The frame list
+    """
+    frameList = GetFrameList( node, jobProperties )
+    if jobProperties.get( "frameorder", "linear" ) == "progressive":
+        frameList = progressive_frame_list( frameList, chunkSize )
+
+    return frameList
+
+def get_output_frame_ranges( node, jobProperties ):
+    """
+    :return: The (start, end, step) ranges of the frames the node will write when submitted with jobProperties
+    """
+    if jobProperties.get( "tilesenabled", False ) and jobProperties.get( "tilessingleframeenabled", False ) and NodeSupportsTiles( node ):
+        singleFrame = int( jobProperties.get( "tilessingleframe", 1 ) )
+        return [ ( singleFrame, singleFrame, 1 ) ]
+
+    return parse_frame_ranges( GetFrameList( node, jobProperties ) )
+
+@submission_memoize( node_job_export_key )
+@evaluate_in_rop_take
+def get_output_frame_templates( node, jobProperties ):
+    """
+    :return: The paths of every file the node writes when submitted with jobProperties, with their frame numbers as
+             Deadline frame tokens
+    """
+    templates = []
+
+    output = GetOutputPath( node )
+    if output and output != "COMMAND":
+        templates.append( get_frame_templated_path( output ) )
+
+    if isExportJob( node, jobProperties ):
+        exportFileParameter = GetExportPath( node )
+        if exportFileParameter is not None:
+            exportFile = get_frame_templated_path( exportFileParameter )
+            if export_will_overwrite( node, jobProperties ):
+                # Frame numbers are appended to the export file to avoid overwriting, see SubmitRenderJob
+                root, ext = os.path.splitext( exportFile )
+                exportFile = root + ".<_FRAME4_>" + ext
+            templates.append( exportFile )
+
+    return [ template for template in templates if template ]
+
+def find_output_collisions( nodes, jobProperties ):
+    """
+    Finds files which more than one of the given ROPs would write. Outputs are first grouped by their paths with the
+    frame tokens left in and their padding ignored, so frames are only expanded for ROPs sharing a path, and then
+    indexed by the file each frame writes in a single pass over those frames.
+    :param nodes: The ROP nodes which will be submitted together
+    :param jobProperties: The current job's properties
+    :return: A list of ( paddedPath, frames, nodePaths ) tuples, where frames is None if the path has no frame number
+    """
+    writersByTemplate = {}
+    for node in nodes:
+        frameRanges = None
+        for templatedPath in get_output_frame_templates( node, jobProperties ):
+            if frameRanges is None:
+                frameRanges = get_output_frame_ranges( node, jobProperties )
+
+            template = DEADLINE_FRAME_TOKEN_REGEX.sub( "<_FRAME_>", templatedPath )
+            writersByTemplate.setdefault( template, [] ).append( ( node.path(), templatedPath, frameRanges ) )
+
+    collisions = []
+    for template, writers in writersByTemplate.items():
+        nodePaths = set( nodePath for nodePath, _, _ in writers )
+        if len( nodePaths ) < 2:
+            continue
+
+        templatedPath = writers[ 0 ][ 1 ]
+        paddedPath = pad_frame_tokens( templatedPath, "#" )
+        if paddedPath == templatedPath:
+            collisions.append( ( templatedPath, None, sorted( nodePaths ) ) )
+            continue
+
+        if not frame_bounds_overlap( [ frameRanges for _, _, frameRanges in writers ] ):
+            continue
+
+        fileOwners = {}
+        collidedFiles = {}
+        for nodePath, writerPath, frameRanges in writers:
+            for frame in iter_frame_ranges( frameRanges ):
+                framePath = expand_frame_tokens( writerPath, frame )
+                owner = fileOwners.setdefault( framePath, nodePath )
+                if owner != nodePath:
+                    collidedFiles.setdefault( framePath, ( frame, set( [ owner ] ) ) )[ 1 ].add( nodePath )
+
+        framesByNodes = {}
+        for frame, owners in collidedFiles.values():
+            framesByNodes.setdefault( frozenset( owners ), [] ).append( frame )
+
+        for owners, frames in framesByNodes.items():
+            collisions.append( ( paddedPath, sorted( frames ), sorted( owners ) ) )
+
+    return collisions
+
+def describe_output_collisions( collisions ):
+    """
+    :param collisions: Collisions as returned by find_output_collisions
+    :return: A human readable description of the collisions, one per line
+    """
+    lines = []
+    for path, frames, nodePaths in collisions:
+        if frames is None:
+            frameDescription = "every frame"
+        elif len( frames ) == 1:
+            frameDescription = "frame %s" % frames[ 0 ]
+        else:
+            frameDescription = "%s frames between %s and %s" % ( len( frames ), frames[ 0 ], frames[ -1 ] )
+
+        lines.append( "  %s  (%s): %s\n" % ( path, frameDescription, ", ".join( nodePaths ) ) )
+
+    return "".join( lines )
+
+def get_auto_tile_regions( node, regionCount, frame ):
+    """
+    Picks tile regions which cover roughly equal render cost, judged by the density of the visible geometry's points
+    on screen, see tile_cost.
+    :param node: The ROP rendered in tiles
+    :param regionCount: The number of regions wanted
+    :param frame: The frame the geometry is evaluated at
+    :return: Regions in the same form as the jigsawregions job property, or None to keep the regular tiles
+    """
+    try:
+        import tile_cost
+        regions = tile_cost.get_cost_balanced_regions( node, regionCount, frame )
+    except Exception as e:
+        print( "Unable to balance the tiles of %s by cost: %s" % ( node.path(), e ) )
+        return None
+
+    if regions:
+        print( "Balanced %s into %s tile regions by the geometry in view" % ( node.path(), len( regions ) // 4 ) )
+    return regions
+
+def get_local_export_pattern( node, jobProperties ):
+    """
+    :return: The OutputPathPattern of the files a local export writes, or None if the node has no export file
+    """
+    exportFile, paddedExportFile = get_standalone_export_path( node )
+    if not exportFile:
+        return None
+
+    if export_will_overwrite( node, jobProperties ):
+        # Frame numbers are appended to the export file to avoid overwriting, see SubmitRenderJob
+        root, ext = os.path.splitext( exportFile )
+        exportFile = root + ".0000" + ext
+
+    return get_path_pattern( exportFile )
+
+def get_local_export_paths( node, frameRanges, parmOverrides ):
+    """
+    :param parmOverrides: Parameter name to unexpanded value overrides applied while exporting
+    :return: The export files a local export of frameRanges is expected to write, in frame order. Each is the export
+             parameter, or its override, evaluated at the frame.
+    """
+    exportFileParameter = GetExportPath( node )
+    if exportFileParameter is None:
+        return []
+
+    unexpanded = parmOverrides.get( exportFileParameter.name() )
+    paths = []
+    seen = set()
+    for frame in iter_frame_ranges( frameRanges ):
+        if unexpanded is None:
+            path = exportFileParameter.evalAtFrame( frame )
+        else:
+            path = expand_string_for_node( exportFileParameter.node(), unexpanded, frame )
+        if path not in seen:
+            seen.add( path )
+            paths.append( path )
+
+    return paths
+
+# Parameters which don't change what is exported for a frame
+EXPORT_HASH_IGNORED_PARMS = ( "execute", "renderdialog", "f1", "f2", "f3" )
+
+def get_parm_signature( parm ):
+    """
+    :return: A string which changes whenever the parameter's value or animation changes, without evaluating it per frame
+    """
+    keyframes = parm.keyframes()
+    if keyframes:
+        return "|".join( "%s:%s" % ( keyframe.frame(), keyframe.expression() if keyframe.isExpressionSet() else keyframe.value() ) for keyframe in keyframes )
+
+    try:
+        return parm.unexpandedString()
+    except hou.OperationFailed:
+        return str( parm.eval() )
+
+def get_export_parm_hash( node, parmOverrides ):
+    """
+    :param node: The exported ROP
+    :param parmOverrides: Parameter name to unexpanded value overrides applied while exporting
+    :return: A hash of the ROP's parameters which affect its export files, and of the saved hip file, since the nodes
+             upstream of the ROP change what it exports as well
+    """
+    digest = hashlib.md5()
+    line = u"hip=%s:%s\n" % ( hou.hipFile.path(), get_file_stamp( hou.hipFile.path() ) )
+    digest.update( line.encode( "utf-8" ) if not isinstance( line, bytes ) else line )
+
+    for parm in node.parms():
+        name = parm.name()
+        if name in EXPORT_HASH_IGNORED_PARMS:
+            continue
+
+        value = parmOverrides[ name ] if name in parmOverrides else get_parm_signature( parm )
+        line = u"%s=%s\n" % ( name, value )
+        digest.update( line.encode( "utf-8" ) if not isinstance( line, bytes ) else line )
+
+    return digest.hexdigest()
+
+def get_export_index_path( pattern ):
+    """
+    :return: The path of the hidden index file kept next to an export pattern's files
+    """
+    directory, fileName = os.path.split( pattern.padded( "#" ) )
+    return os.path.join( directory, "." + fileName + ".deadline.json" )
+
+def read_export_index( pattern, parmHash ):
+    """
+    :return: A dictionary of frame string to the [ mtime, size ] of the file exported for it, for exports made with
+             the same parameter hash
+    """
+    try:
+        with open( get_export_index_path( pattern ), "r" ) as fileHandle:
+            index = json.load( fileHandle )
+    except ( IOError, OSError, ValueError ):
+        return {}
+
+    if index.get( "parmHash" ) != parmHash:
+        return {}
+
+    return index.get( "frames", {} )
+
+def write_export_index( pattern, parmHash, frames ):
+    try:
+        with open( get_export_index_path( pattern ), "w" ) as fileHandle:
+            json.dump( { "parmHash": parmHash, "frames": frames }, fileHandle )
+    except ( IOError, OSError ) as e:
+        print( "Unable to write the export index for %s: %s" % ( pattern.padded( "#" ), e ) )
+
+def get_file_stamp( path ):
+    """
+    :return: [ mtime, size ] of the file, or None if it doesn't exist
+    """
+    try:
+        stat = os.stat( path )
+    except OSError:
+        return None
+    return [ stat.st_mtime, stat.st_size ]
+
+def find_reusable_exports( pattern, frameRanges, parmHash ):
+    """
+    Finds the frames whose export files are still up to date. A frame is up to date if its file is the one recorded
+    by a previous local export with the same ROP parameters and saved hip file, and it was written after the hip file
+    was last saved.
+    :return: The set of frames which don't need to be exported again
+    """
+    if not pattern.hasFrame or hou.hipFile.hasUnsavedChanges():
+        return set()
+
+    hipStamp = get_file_stamp( hou.hipFile.path() )
+    recordedFrames = read_export_index( pattern, parmHash )
+    if hipStamp is None or not recordedFrames:
+        return set()
+
+    reusableFrames = set()
+    for frame in iter_frame_ranges( frameRanges ):
+        recordedStamp = recordedFrames.get( pattern.frame_string( frame ) )
+        if recordedStamp is None:
+            continue
+
+        stamp = get_file_stamp( pattern.frame( frame ) )
+        if stamp == recordedStamp and stamp[ 0 ] >= hipStamp[ 0 ]:
+            reusableFrames.add( frame )
+
+    return reusableFrames
+
+def record_exports( pattern, frameRanges, parmHash ):
+    """
+    Records the files written by a local export so later submissions can reuse them.
+    """
+    if not pattern.hasFrame:
+        return
+
+    frames = read_export_index( pattern, parmHash )
+    for frame in iter_frame_ranges( frameRanges ):
+        stamp = get_file_stamp( pattern.frame( frame ) )
+        if stamp is not None:
+            frames[ pattern.frame_string( frame ) ] = stamp
+
+    write_export_index( pattern, parmHash, frames )
+
+def remove_frames( frameRanges, frames ):
+    """
+    :return: frameRanges without the given frames, with each range split around the frames removed from it
+    """
+    remainingRanges = []
+    for start, end, step in frameRanges:
+        spanStart = None
+        previous = None
+        for frame in iter_frame_ranges( [ ( start, end, step ) ] ):
+            if frame in frames:
+                if spanStart is not None:
+                    remainingRanges.append( ( spanStart, previous, step ) )
+                    spanStart = None
+            elif spanStart is None:
+                spanStart = frame
+            previous = frame
+
+        if spanStart is not None:
+            remainingRanges.append( ( spanStart, previous, step ) )
+
+    return remainingRanges
+
+def export_locally( node, frameRanges, ignoreInputs, jobProperties, parmOverrides ):
+    """
+    Exports the given frames of a ROP before its render job is submitted.
+    If the localexportprocesses job property is set, the frames are exported by that many background hython processes
+    and the submission only continues once every expected export file exists. Otherwise, every range is rendered in
+    this session.
+    If the reuseexports job property is set, frames whose export files are still up to date aren't exported again.
+    :param node: The ROP to export
+    :param frameRanges: The (start, end, step) ranges to export
+    :param ignoreInputs: Whether the ROP's inputs should be rendered
+    :param jobProperties: The current job's properties
+    :param parmOverrides: Parameter name to unexpanded value overrides applied while exporting, ie. to add frame numbers
+    """
+    reuseExports = jobProperties.get( "reuseexports", False )
+    pattern = None
+    if reuseExports:
+        pattern = get_local_export_pattern( node, jobProperties )
+        if pattern is not None:
+            parmHash = get_export_parm_hash( node, parmOverrides )
+            reusableFrames = find_reusable_exports( pattern, frameRanges, parmHash )
+            if reusableFrames:
+                print( "Reusing %s up to date export file(s) of %s" % ( len( reusableFrames ), node.path() ) )
+                frameRanges = remove_frames( frameRanges, reusableFrames )
+
+    if not frameRanges:
+        return
+
+    processCount = int( jobProperties.get( "localexportprocesses", 0 ) )
+    if processCount > 0:
+        import local_export
+        local_export.export_frames( node, frameRanges, ignoreInputs, processCount, parmOverrides )
+
+        missingPaths = [ path for path in get_local_export_paths( node, frameRanges, parmOverrides ) if not os.path.isfile( path ) ]
+        if missingPaths:
+            raise hou.OperationFailed( "Local export of %s did not write %s file(s), ie. %s" % ( node.path(), len( missingPaths ), missingPaths[ 0 ] ) )
+    else:
+        originalValues = {}
+        try:
+            for parmName, value in parmOverrides.items():
+                originalValues[ parmName ] = node.parm( parmName ).unexpandedString()
+                node.parm( parmName ).set( value )
+
+            for frameRange in frameRanges:
+                node.render( frameRange, (), ignore_inputs=ignoreInputs )
+        finally:
+            # Leave it how we found it
+            for parmName, value in originalValues.items():
+                node.parm( parmName ).set( value )
+
+    if pattern is not None:
+        record_exports( pattern, frameRanges, parmHash )
+
+# The ROP's take stays current for the whole submission, so everything evaluated or rendered for it uses the take
+@evaluate_in_rop_take
 def SubmitRenderJob( node, jobProperties, dependencies ):
     jobCount = 1
 
@@ -642,6 +1605,15 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
     if tilesEnabled:
         tilesEnabled = NodeSupportsTiles( node )
 
+    # Regions drawn in Jigsaw are kept as they are
+    if tilesEnabled and jobProperties.get( "autotileregions", False ) and not ( jigsawEnabled and jigsawRegions ):
+        autoRegions = get_auto_tile_regions( node, regionCount, singleFrame if singleFrameTiles else hou.frame() )
+        if autoRegions:
+            jigsawEnabled = True
+            jigsawRegions = autoRegions
+            jigsawRegionCount = len( autoRegions ) // 4
+            regionCount = jigsawRegionCount
+
     regionJobCount = 1
     if tilesEnabled and not singleFrameTiles:
         regionJobCount = regionCount
@@ -697,44 +1669,37 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
             if singleFrameTiles and tilesEnabled:
                 node.render( (singleFrame,singleFrame,1), (), ignore_inputs=ignoreInputs )
             else:
-                exportPath = ""
+                parmOverrides = {}
 
-                if isVray: # we need to temporarily change the export path to avoid overwriting, then change it back later
+                if isVray and export_will_overwrite( node, jobProperties ): # we need to temporarily change the export path to have frame numbers to avoid overwriting
                     exportPath = node.parm("render_export_filepath").unexpandedString()
-                    if export_will_overwrite( node, jobProperties ): # temporarily change to have frame numbers
-                        node.parm("render_export_filepath").set(".$F4".join(os.path.splitext(exportPath)))
+                    parmOverrides[ "render_export_filepath" ] = ".$F4".join(os.path.splitext(exportPath))
 
                 frameStep = 1
 
                 if jobProperties.get( "overrideframes", False ):
-                    frameList = CallDeadlineCommand( [ "-ParseFrameList", jobProperties.get( "framelist", "0" ) , "False" ] ).strip()
-                    renderFrames = frameList.split( "," )
-                    for frame in renderFrames:
-                        frame = int( frame )
-                        node.render( ( frame, frame, frameStep ), (), ignore_inputs=ignoreInputs )
+                    # The override frames are collapsed into ranges, so each contiguous span is exported with one render
+                    export_locally( node, parse_frame_ranges( GetFrameList( node, jobProperties ) ), ignoreInputs, jobProperties, parmOverrides )
                 else:
                     startFrame = 1
-                    startFrameParm = node.parm( "f1" )
-                    if startFrameParm != None:
-                        startFrame = int(startFrameParm.eval())
+                    startFrameValue = eval_parm( node, "f1" )
+                    if startFrameValue != None:
+                        startFrame = int(startFrameValue)
 
                     endFrame = 1
-                    endFrameParm = node.parm( "f2" )
-                    if endFrameParm != None:
-                        endFrame = int(endFrameParm.eval())
+                    endFrameValue = eval_parm( node, "f2" )
+                    if endFrameValue != None:
+                        endFrame = int(endFrameValue)
 
-                    frameStepParm = node.parm( "f3" )
-                    if frameStepParm != None:
-                        frameStep = int(frameStepParm.eval())
+                    frameStepValue = eval_parm( node, "f3" )
+                    if frameStepValue != None:
+                        frameStep = int(frameStepValue)
 
                     # This seems to be here erroneously, and removes padding from Image viewing in Deadline
                     if output and output != "COMMAND" and not isVray:
-                        paddedOutputFile = output.eval()
-
-                    node.render( (startFrame,endFrame,frameStep), (), ignore_inputs=ignoreInputs )
+                        paddedOutputFile = outputFile
 
-                if isVray:
-                    node.parm("render_export_filepath").set(exportPath) # Leave it how we found it
+                    export_locally( node, [ (startFrame,endFrame,frameStep) ], ignoreInputs, jobProperties, parmOverrides )
         else:
             for regionjobNum in range( 0, regionJobCount ):
                 doShotgun = not ( exportJob or tilesEnabled )
@@ -769,6 +1734,9 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                     fileHandle.write( "JobDependencies=%s\n" % dependencies )
                     fileHandle.write( "OnJobComplete=%s\n" % jobProperties.get( "onjobcomplete", "Nothing" ) )
 
+                    for index, ( name, value ) in enumerate( sorted( jobProperties.get( "environment", {} ).items() ) ):
+                        fileHandle.write( "EnvironmentKeyValue%s=%s=%s\n" % ( index, name, value ) )
+
                     #When we render Wedge nodes with separateWedgeJobs disabled a single job is submitted where each task is a different wedge ID instead of the actual render frame
                     #When we render tile jobs with singleFrameTiles enabled each task is a separate tile for the same frame instead of the actual render frame.
                     #In both of these cases we do not want the Job to be Frame dependent since the frames will not match.
@@ -799,31 +1767,19 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                         else:
                             fileHandle.write( "Frames=%s\n" % singleFrame )
                     else:
-                        fileHandle.write( "Frames=%s\n" % GetFrameList( node, jobProperties) )
+                        fileHandle.write( "Frames=%s\n" % get_submitted_frame_list( node, jobProperties, determine_chunk_size( node, jobProperties ) ) )
 
                     fileHandle.write( "ChunkSize=%s\n" % determine_chunk_size(node, jobProperties) )
 
                     if tilesEnabled and singleFrameTiles and not exportJob:
-                        imageFileName = outputFile
-                        tileName = ""
-                        paddingRegex = re.compile( "(#+)", re.IGNORECASE )
-                        matches = PADDED_NUMBER_REGEX.findall( imageFileName )
-                        if matches != None and len( matches ) > 0:
-                            paddingString = matches[ len( matches ) - 1 ]
-                            paddingSize = len( paddingString )
-                            padding = str( singleFrame )
-                            padding = "_tile?_" + padding
-                            tileName = RightReplace( imageFileName, paddingString, padding, 1 )
-                        else:
-                            splitFilename = os.path.splitext(imageFileName)
-                            tileName = splitFilename[0]+"_tile?_"+splitFilename[1]
+                        outputPattern = get_path_pattern( outputFile )
 
                         tileRange = range(0, tilesInX*tilesInY)
                         if jigsawEnabled:
                             tileRange = range(0, jigsawRegionCount)
 
                         for currTile in tileRange:
-                            regionOutputFileName = tileName.replace( "?", str(currTile) )
+                            regionOutputFileName = outputPattern.tile( currTile, singleFrame )
                             fileHandle.write( "OutputFilename0Tile%s=%s\n"%(currTile,regionOutputFileName) )
 
                     if not exportJob:
@@ -850,7 +1806,8 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                     if should_precache:
                         assets_to_precache = get_asset_paths_to_precache(
                             scene_file_is_aux=jobProperties.get("submitscene", False),
-                            files_to_ignore={output.unexpandedString()} if output and output != 'COMMAND' else {}
+                            files_to_ignore={output.unexpandedString()} if output and output != 'COMMAND' else {},
+                            scene_file=GetSceneFile( jobProperties )
                         )
                         write_asset_paths_to_job_file(assets_to_precache, fileHandle)
 
@@ -860,7 +1817,7 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                 pluginInfoFile = os.path.join( homeDir, "temp", "houdini_plugin_info%d.job" % (wedgeNum * regionJobCount + regionjobNum) )
                 with open( pluginInfoFile, "w" ) as fileHandle:
                     if not jobProperties.get( "submitscene",False ):
-                        fileHandle.write( "SceneFile=%s\n" % hou.hipFile.path() )
+                        fileHandle.write( "SceneFile=%s\n" % GetSceneFile( jobProperties ) )
 
                     # This is only needed for output nodes that aren't using the HOUDINI_PATHMAP env variable and
                     # are not using houdini's tokens for the path. ie. $HIP.
@@ -956,12 +1913,17 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
 
                 arguments = [ jobInfoFile, pluginInfoFile ]
                 if jobProperties.get( "submitscene", False ):
-                    arguments.append( hou.hipFile.path() )
+                    arguments.append( GetSceneFile( jobProperties ) )
 
                 jobResult = CallDeadlineCommand( arguments )
                 jobId = GetJobIdFromSubmission( jobResult )
                 renderJobIds.append( jobId )
 
+                # Tile and wedge tasks don't render whole frames, so their timings aren't used to size chunks
+                recordHistory = jobProperties.get( "adaptivechunksize", False )
+                if recordHistory and not ( tilesEnabled or isWedge or isHQueueSim ):
+                    record_submitted_job( jobId, node )
+
                 print("---------------------------------------------------")
                 print( "\n".join( [ line.strip() for line in jobResult.split( "\n" ) if line.strip() ] ) )
 
@@ -1042,6 +2004,9 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                             fileHandle.write( "TileJobTilesInY=%s\n" % tilesInY )
 
                         fileHandle.write( "TileJobFrame=%s\n" % singleFrame )
+                    elif jobProperties.get( "frameorder", "linear" ) == "progressive":
+                        fileHandle.write( "Frames=%s\n" % get_submitted_frame_list( node, jobProperties, 1 ) )
+                        fileHandle.write( "ChunkSize=1\n" )
                     elif jobProperties.get( "overrideframes", False ):
                         fileHandle.write( "Frames=%s\n" % jobProperties.get( "framelist","0" ) )
                         fileHandle.write( "ChunkSize=1\n" )
@@ -1051,24 +2016,10 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
 
                     if paddedOutputFile != "":
                         if exportTilesEnabled and singleFrameTiles:
-                            tileName = paddedOutputFile
-                            paddingRegex = re.compile( "(#+)", re.IGNORECASE )
-                            matches = paddingRegex.findall( os.path.basename( tileName ) )
-                            if matches != None and len( matches ) > 0:
-                                paddingString = matches[ len( matches ) - 1 ]
-                                paddingSize = len( paddingString )
-                                padding = str(singleFrame)
-                                while len(padding) < paddingSize:
-                                    padding = "0" + padding
-
-                                padding = "_tile?_" + padding
-                                tileName = RightReplace( tileName, paddingString, padding, 1 )
-                            else:
-                                splitFilename = os.path.splitext(tileName)
-                                tileName = splitFilename[0]+"_tile?_"+splitFilename[1]
+                            outputPattern = get_path_pattern( outputFile )
 
                             for currTile in range(0, tilesInX*tilesInY):
-                                regionOutputFileName = tileName.replace( "?", str(currTile) )
+                                regionOutputFileName = outputPattern.tile( currTile, singleFrame )
                                 fileHandle.write( "OutputFilename0Tile%s=%s\n"%(currTile,regionOutputFileName) )
 
                         else:
@@ -1164,29 +2115,11 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                                 curRegion = 0
 
 
-                                output = GetOutputPath( node )
                                 imageFileName = outputFile
                                 if imageFileName == "":
                                     continue
 
-                                tileName = ""
-                                outputName = ""
-                                paddingRegex = re.compile( "(#+)", re.IGNORECASE )
-                                matches = PADDED_NUMBER_REGEX.findall( imageFileName )
-                                if matches != None and len( matches ) > 0:
-                                    paddingString = matches[ len( matches ) - 1 ]
-                                    paddingSize = len( paddingString )
-                                    padding = str(singleFrame)
-                                    while len(padding) < paddingSize:
-                                        padding = "0" + padding
-
-                                    outputName = RightReplace( imageFileName, paddingString, padding, 1 )
-                                    padding = "_tile#_" + padding
-                                    tileName = RightReplace( imageFileName, paddingString, padding, 1 )
-                                else:
-                                    outputName = imageFileName
-                                    splitFilename = os.path.splitext(imageFileName)
-                                    tileName = splitFilename[0]+"_tile#_"+splitFilename[1]
+                                outputPattern = get_path_pattern( imageFileName )
 
                                 if jigsawEnabled:
                                     for region in range(0,jigsawRegionCount):
@@ -1200,15 +2133,7 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                                         if yend >= height:
                                             yend  = height-1
 
-                                        regionOutputFileName = tileName
-                                        matches = paddingRegex.findall( os.path.basename( tileName ) )
-                                        if matches != None and len( matches ) > 0:
-                                            paddingString = matches[ len( matches ) - 1 ]
-                                            paddingSize = len( paddingString )
-                                            padding = str(curRegion)
-                                            while len(padding) < paddingSize:
-                                                padding = "0" + padding
-                                            regionOutputFileName = RightReplace( tileName, paddingString, padding, 1 )
+                                        regionOutputFileName = outputPattern.tile( curRegion, singleFrame )
 
                                         fileHandle.write( "RegionFilename%s=%s\n" % (curRegion, regionOutputFileName) )
                                         fileHandle.write( "RegionLeft%s=%s\n" % (curRegion, xstart) )
@@ -1235,15 +2160,7 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                                             if yend >= height:
                                                 yend  = height-1
 
-                                            regionOutputFileName = tileName
-                                            matches = paddingRegex.findall( os.path.basename( tileName ) )
-                                            if matches != None and len( matches ) > 0:
-                                                paddingString = matches[ len( matches ) - 1 ]
-                                                paddingSize = len( paddingString )
-                                                padding = str(curRegion)
-                                                while len(padding) < paddingSize:
-                                                    padding = "0" + padding
-                                                regionOutputFileName = RightReplace( tileName, paddingString, padding, 1 )
+                                            regionOutputFileName = outputPattern.tile( curRegion, singleFrame )
 
                                             fileHandle.write( "RegionFilename%s=%s\n" % (curRegion, regionOutputFileName) )
                                             fileHandle.write( "RegionLeft%s=%s\n" % (curRegion, xstart) )
@@ -1330,16 +2247,11 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
         if tilesEnabled and jobProperties.get( "submitdependentassembly" ) and ( renderJobIds or exportJobIds ):
             assemblyJobIds = []
 
-            renderFrames = None
+            # Frames are generated from the collapsed ranges as the config files are written, rather than expanded up front
             if singleFrameTiles:
-                renderFrames = [ singleFrame ]
+                renderFrames = iter_frame_ranges( [ ( int( singleFrame ), int( singleFrame ), 1 ) ] )
             else:
-                if jobProperties.get( "overrideframes", False ):
-                    frameList = CallDeadlineCommand( [ "-ParseFrameList", jobProperties.get( "framelist","0" ) ,"False" ] ).strip()
-                    renderFrames = frameList.split( "," )
-                else:
-                    frameList = CallDeadlineCommand( [ "-ParseFrameList", GetFrameInfo( node ), "False" ] ).strip()
-                    renderFrames = frameList.split( "," )
+                renderFrames = iter_frame_ranges( parse_frame_ranges( GetFrameList( node, jobProperties ) ) )
 
             jobName = jobProperties.get( "jobname", "Untitled" )
             jobName = "%s - %s - Assembly"%(jobName, node.path())
@@ -1406,30 +2318,12 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                 fileHandle.write( "MultipleConfigFiles=%s\n" % True )
 
             configFiles = []
+            outputPattern = get_path_pattern( outputFile )
 
             for frame in renderFrames:
 
-                output = GetOutputPath( node )
                 imageFileName = outputFile
-
-                tileName = ""
-                outputName = ""
-                paddingRegex = re.compile( "(#+)", re.IGNORECASE )
-                matches = PADDED_NUMBER_REGEX.findall( imageFileName )
-                if matches != None and len( matches ) > 0:
-                    paddingString = matches[ len( matches ) - 1 ]
-                    paddingSize = len( paddingString )
-                    padding = str(frame)
-                    while len(padding) < paddingSize:
-                        padding = "0" + padding
-
-                    outputName = RightReplace( imageFileName, paddingString, padding, 1 )
-                    padding = "_tile#_" + padding
-                    tileName = RightReplace( imageFileName, paddingString, padding, 1 )
-                else:
-                    outputName = imageFileName
-                    splitFilename = os.path.splitext(imageFileName)
-                    tileName = splitFilename[0]+"_tile#_"+splitFilename[1]
+                outputName = outputPattern.frame( frame )
 
                 # Create the directory for the config file if it doesn't exist.
                 directory = os.path.dirname(imageFileName)
@@ -1472,15 +2366,7 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                             xRegion = jigsawRegions[region*4]
                             yRegion = jigsawRegions[region*4+2]
 
-                            regionOutputFileName = tileName
-                            matches = paddingRegex.findall( os.path.basename( tileName ) )
-                            if matches != None and len( matches ) > 0:
-                                paddingString = matches[ len( matches ) - 1 ]
-                                paddingSize = len( paddingString )
-                                padding = str(currTile)
-                                while len(padding) < paddingSize:
-                                    padding = "0" + padding
-                                regionOutputFileName = RightReplace( tileName, paddingString, padding, 1 )
+                            regionOutputFileName = outputPattern.tile( currTile, frame )
 
                             fileHandle.write( "Tile%iFileName=%s\n"%(currTile,regionOutputFileName) )
                             fileHandle.write( "Tile%iX=%s\n"%(currTile,xRegion) )
@@ -1500,15 +2386,7 @@ def SubmitRenderJob( node, jobProperties, dependencies ):
                                 xRegion = x*width
                                 yRegion = y*height
 
-                                regionOutputFileName = tileName
-                                matches = paddingRegex.findall( os.path.basename( tileName ) )
-                                if matches != None and len( matches ) > 0:
-                                    paddingString = matches[ len( matches ) - 1 ]
-                                    paddingSize = len( paddingString )
-                                    padding = str(currTile)
-                                    while len(padding) < paddingSize:
-                                        padding = "0" + padding
-                                    regionOutputFileName = RightReplace( tileName, paddingString, padding, 1 )
+                                regionOutputFileName = outputPattern.tile( currTile, frame )
 
                                 fileHandle.write( "Tile%iFileName=%s\n"%(currTile,regionOutputFileName) )
                                 fileHandle.write( "Tile%iX=%s\n"%(currTile,xRegion) )
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+from multiprocessing.pool import ThreadPool
+import cache_index
+import directory_manager
+import local_cache
+
+# identical frames of a cache's versions become hard links to one file in this folder of the version root
+STORE_DIR_NAME = '.store'
+MANIFEST_NAME = '.dedupe_manifest.json'
+LOCK_NAME = '.dedupe.lock'
+LINK_PREFIX = '.dedupe.'
+HASH_CHUNK_SIZE = 1024 * 1024
+# hashlib lets go of the GIL while it hashes, so threads hash files in parallel
+HASH_THREADS = 4
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_store_path(cache_root, digest):
+    return os.path.join(cache_root, STORE_DIR_NAME, digest[:2], digest)
+
+def read_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {'files': {}}
+
+def write_manifest(manifest_path, manifest):
+    staged_path = directory_manager.get_staged_path(manifest_path)
+    with open(staged_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    directory_manager.commit_staged_file(staged_path, manifest_path)
+
+def list_frames(render_node, cache_root):
+    # {path relative to the version root: (size, mtime)} of every loose frame of every version but the one being cached
+    current_version = int(render_node.evalParm("cacheversion"))
+    frames = {}
+    for version in directory_manager.get_cache_versions(render_node):
+        if version == current_version:
+            continue
+        for frame, path in directory_manager.get_frame_files(render_node, version):
+            path_stat = os.stat(path)
+            frames[os.path.relpath(path, cache_root).replace('\\', '/')] = (path_stat.st_size, path_stat.st_mtime)
+    return frames
+
+def hash_frames(cache_root, frames, manifest, thread_count):
+    # {relative path: sha256} of the frames that could have a duplicate, reusing the manifest's hashes of unchanged files
+    sizes = {}
+    for size, mtime in frames.values():
+        sizes[size] = sizes.get(size, 0) + 1
+
+    hashes = {}
+    to_hash = []
+    for relative_path, (size, mtime) in frames.items():
+        if sizes[size] < 2 or size == 0:
+            continue
+        known = manifest['files'].get(relative_path)
+        if known and known['size'] == size and known['mtime'] == mtime:
+            hashes[relative_path] = known['hash']
+        else:
+            to_hash.append(relative_path)
+
+    pool = ThreadPool(thread_count)
+    try:
+        for relative_path, digest in pool.imap_unordered(lambda x: (x, hash_file(os.path.join(cache_root, x))), to_hash):
+            hashes[relative_path] = digest
+    finally:
+        pool.close()
+        pool.join()
+
+    return hashes
+
+def link_to_store(path, store_path, expected):
+    # swaps a frame for a hard link to its content in the store. the link is made under a temporary name and renamed
+    # over the frame, so a reader opening the frame gets either file, both with the same bytes, and readers that
+    # already have it open keep reading the old one
+    path_stat = os.stat(path)
+    if (path_stat.st_size, path_stat.st_mtime) != expected:
+        # cached again since it was hashed
+        return False
+
+    if not os.path.exists(store_path):
+        store_dir = os.path.dirname(store_path)
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        os.link(path, store_path)
+        return False
+
+    store_stat = os.stat(store_path)
+    if (store_stat.st_dev, store_stat.st_ino) == (path_stat.st_dev, path_stat.st_ino):
+        return False
+
+    link_path = os.path.join(os.path.dirname(path), LINK_PREFIX + os.path.basename(path))
+    if os.path.exists(link_path):
+        os.remove(link_path)
+    os.link(store_path, link_path)
+    try:
+        os.replace(link_path, path)
+    except OSError:
+        # open by a reader on windows
+        os.remove(link_path)
+        raise
+    return True
+
+def prune_store(cache_root):
+    # content only the store still links to belonged to versions that have been removed
+    store_root = os.path.join(cache_root, STORE_DIR_NAME)
+    if not os.path.isdir(store_root):
+        return 0
+
+    pruned = 0
+    for dirpath, dirnames, filenames in os.walk(store_root):
+        for filename in filenames:
+            store_path = os.path.join(dirpath, filename)
+            if os.stat(store_path).st_nlink == 1:
+                os.remove(store_path)
+                pruned += 1
+    return pruned
+
+def dedupe_versions(render_node, thread_count=HASH_THREADS):
+    """
+    Replaces frames that are identical across a cache node's versions with hard links to one copy in a content store
+    in the version root, and records the links in a manifest next to it. The version being cached to is left alone.
+    Returns the bytes freed.
+    """
+    if not hasattr(os, 'link') or not hasattr(os, 'replace'):
+        print("Hard links aren't available, not deduplicating %s" % render_node.path())
+        return 0
+
+    cache_root = directory_manager.get_cache_root(render_node)
+    if not os.path.isdir(cache_root):
+        return 0
+
+    lock = local_cache.FileLock(os.path.join(cache_root, LOCK_NAME))
+    if not lock.acquire(blocking=False):
+        print("%s is already being deduplicated" % render_node.path())
+        return 0
+
+    try:
+        manifest_path = os.path.join(cache_root, MANIFEST_NAME)
+        manifest = read_manifest(manifest_path)
+        frames = list_frames(render_node, cache_root)
+        hashes = hash_frames(cache_root, frames, manifest, thread_count)
+
+        counts = {}
+        for digest in hashes.values():
+            counts[digest] = counts.get(digest, 0) + 1
+
+        freed = 0
+        files = {}
+        for relative_path, digest in sorted(hashes.items()):
+            path = os.path.join(cache_root, relative_path)
+            store_path = get_store_path(cache_root, digest)
+
+            # content only one frame has stays out of the store, unless an earlier run put it there
+            if counts[digest] > 1 or os.path.exists(store_path):
+                try:
+                    if link_to_store(path, store_path, frames[relative_path]):
+                        freed += frames[relative_path][0]
+                except (IOError, OSError) as e:
+                    print("Unable to deduplicate %s: %s" % (path, e))
+                    continue
+
+            # the hashes of unlinked frames are kept too, so the next run only hashes what changed
+            path_stat = os.stat(path)
+            files[relative_path] = {'hash': digest, 'size': path_stat.st_size, 'mtime': path_stat.st_mtime, 'links': path_stat.st_nlink}
+
+        write_manifest(manifest_path, {'store': STORE_DIR_NAME, 'files': files})
+        pruned = prune_store(cache_root)
+    finally:
+        lock.release()
+
+    print("Deduplicated %s: %s freed, %s unused store files removed" % (render_node.path(), cache_index.format_bytes(freed), pruned))
+    return freed
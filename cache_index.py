@@ -0,0 +1,177 @@
+import json
+import os
+import cache_pack
+import directory_manager
+import path_schema
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# kept in the version root, next to the version folders it describes
+INDEX_FILE_NAME = '.cache_index.json'
+
+
+def list_dir(path):
+    # (name, is_dir, size, mtime) of every entry, from a single directory scan where os.scandir is available
+    if scandir is not None:
+        entries = []
+        for entry in scandir(path):
+            stat = entry.stat()
+            entries.append((entry.name, entry.is_dir(), stat.st_size, stat.st_mtime))
+        return entries
+
+    entries = []
+    for name in os.listdir(path):
+        stat = os.stat(os.path.join(path, name))
+        entries.append((name, os.path.isdir(os.path.join(path, name)), stat.st_size, stat.st_mtime))
+    return entries
+
+def get_dir_stamp(entries):
+    # changes when a file is added to or removed from a folder, and when one is written to in place,
+    # which leaves the folder's own mtime alone
+    files = [x for x in entries if not x[1]]
+    return [len(files), sum(x[2] for x in files), max([x[3] for x in files] or [0])]
+
+def scan_version_frames(version_dir, name, version, schema=None, entries=None):
+    # {frame: (size, mtime)} of the frames written to a version folder, loose or packed
+    schema = schema or path_schema.get_schema()
+    ext = path_schema.DEFAULT_FIELDS['ext']
+
+    frames = {}
+    packed = {}
+    for entry_name, is_dir, size, mtime in (list_dir(version_dir) if entries is None else entries):
+        if is_dir:
+            continue
+        if entry_name == cache_pack.ARCHIVE_NAME:
+            packed = cache_pack.read_index(os.path.join(version_dir, entry_name)) or {}
+            continue
+        fields = schema.parse_filename(entry_name, name=name, version=version, ext=ext)
+        if fields and 'frame' in fields:
+            frames[fields['frame']] = (size, mtime)
+
+    # loose frames were cached again after the version was packed
+    for entry_name, entry in packed.items():
+        fields = schema.parse_filename(entry_name, name=name, version=version, ext=ext)
+        if fields and 'frame' in fields and fields['frame'] not in frames:
+            frames[fields['frame']] = (entry[1], entry[2])
+
+    return frames
+
+def to_spans(frames):
+    # sorted frames as run-length [start, end] spans, ie. 1, 2, 3, 7, 8 -> [[1, 3], [7, 8]]
+    spans = []
+    for frame in sorted(frames):
+        if spans and frame == spans[-1][1] + 1:
+            spans[-1][1] = frame
+        else:
+            spans.append([frame, frame])
+    return spans
+
+def format_spans(spans):
+    return ','.join(str(x[0]) if x[0] == x[1] else '%s-%s' % (x[0], x[1]) for x in spans)
+
+def summarize_version(frames, dir_mtime, stamp):
+    return {
+        'dir_mtime': dir_mtime,
+        'stamp': stamp,
+        'frames': to_spans(frames),
+        'count': len(frames),
+        'bytes': sum(x[0] for x in frames.values()),
+        'mtime': max([x[1] for x in frames.values()] or [0]),
+    }
+
+def read_index(index_path):
+    try:
+        with open(index_path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def write_index(index_path, cache_root, index):
+    try:
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+
+        # creating the index changes the root's mtime, overwriting it in place doesn't
+        root_mtime = os.stat(cache_root).st_mtime
+        if root_mtime != index['root_mtime']:
+            index['root_mtime'] = root_mtime
+            with open(index_path, 'w') as f:
+                json.dump(index, f)
+    except (IOError, OSError) as e:
+        print("Unable to write the cache index %s: %s" % (index_path, e))
+
+def get_cache_index(render_node):
+    # {version: {'frames', 'count', 'bytes', 'mtime', 'dir_mtime', 'stamp'}} of the node's cache. frames are only
+    # parsed again in folders whose mtime changed since the index was written, which adding, removing or renaming a
+    # frame over another does
+    cache_root = directory_manager.get_cache_root(render_node)
+    if not os.path.isdir(cache_root):
+        return {}
+
+    schema = path_schema.get_schema()
+    name = render_node.name()
+    index_path = os.path.join(cache_root, INDEX_FILE_NAME)
+    index = read_index(index_path)
+
+    root_mtime = os.stat(cache_root).st_mtime
+    dirty = index.get('root_mtime') != root_mtime
+    if not dirty:
+        # no version was added or removed, but frames may have been written into a version folder since
+        version_dirs = dict((x, [y[0], os.stat(os.path.join(cache_root, y[0])).st_mtime]) for x, y in index['version_dirs'].items())
+    else:
+        version_dirs = {}
+        for entry_name, is_dir, size, mtime in list_dir(cache_root):
+            version = schema.parse_version_dir(entry_name, name=name) if is_dir else None
+            if version is not None:
+                version_dirs[str(version)] = [entry_name, mtime]
+
+    # frames written in place leave the folder's mtime alone. only the newest version is likely to be cached over
+    # again, so only its files are listed to catch that
+    newest = max(version_dirs, key=int) if version_dirs else None
+
+    versions = {}
+    for version, (dir_name, dir_mtime) in version_dirs.items():
+        cached = index.get('versions', {}).get(version)
+        if cached and cached['dir_mtime'] == dir_mtime and version != newest:
+            versions[version] = cached
+            continue
+
+        version_dir = os.path.join(cache_root, dir_name)
+        entries = list_dir(version_dir)
+        stamp = get_dir_stamp(entries)
+        if cached and cached['dir_mtime'] == dir_mtime and cached.get('stamp') == stamp:
+            versions[version] = cached
+        else:
+            frames = scan_version_frames(version_dir, name, int(version), schema, entries)
+            versions[version] = summarize_version(frames, dir_mtime, stamp)
+            dirty = True
+
+    if dirty:
+        write_index(index_path, cache_root, {'root_mtime': root_mtime, 'version_dirs': version_dirs, 'versions': versions})
+
+    return dict((int(x), y) for x, y in versions.items())
+
+def get_latest_version(render_node):
+    versions = [x for x, y in get_cache_index(render_node).items() if y['count']]
+    return max(versions) if versions else None
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024.0:
+            return "%.1f %s" % (size, unit)
+        size /= 1024.0
+    return "%.1f TB" % size
+
+def build_version_menu(render_node):
+    # menu items for a version parm, newest first, ie. ['3', 'v3  1-240  (2.1 GB)', ...]
+    menu = []
+    for version, info in sorted(get_cache_index(render_node).items(), reverse=True):
+        menu.append(str(version))
+        menu.append("v%s  %s  (%s)" % (version, format_spans(info['frames']) or 'empty', format_bytes(info['bytes'])))
+    return menu
@@ -0,0 +1,156 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import local_cache
+
+# a packed version keeps all its frames in this one file in the version folder
+ARCHIVE_NAME = 'frames.cachepack'
+MAGIC = b'HCPACK01'
+# the end of an archive is the offset and length of its index followed by the magic again
+FOOTER = struct.Struct('<QQ8s')
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+EXTRACT_PREFIX = '.extract.'
+# packed frames are extracted into the local cache tier, or into a tier of their own in the temp folder when there
+# is none, so they're evicted either way
+EXTRACT_DIR_NAME = 'hou_cache_packed'
+
+
+def get_archive_path(version_dir):
+    return os.path.join(version_dir, ARCHIVE_NAME)
+
+def copy_range(source, f, offset, size):
+    source.seek(offset)
+    while size > 0:
+        data = source.read(min(size, COPY_CHUNK_SIZE))
+        if not data:
+            raise IOError("%s ends before the frames in its index" % source.name)
+        f.write(data)
+        size -= len(data)
+
+def write_archive(archive_path, frame_paths, packed_path=None, packed_index=None):
+    # the frame files one after the other behind the magic, then a json index of {file name: [offset, size, mtime]}.
+    # the frames of an older archive that aren't among the frame files are copied over from it as they are
+    index = {}
+    with open(archive_path, 'wb') as f:
+        f.write(MAGIC)
+        for frame_path in frame_paths:
+            stat = os.stat(frame_path)
+            offset = f.tell()
+            with open(frame_path, 'rb') as frame:
+                shutil.copyfileobj(frame, f, COPY_CHUNK_SIZE)
+
+            size = f.tell() - offset
+            if size != stat.st_size:
+                raise IOError("%s changed while it was packed" % frame_path)
+            index[os.path.basename(frame_path)] = [offset, size, stat.st_mtime]
+
+        if packed_index:
+            with open(packed_path, 'rb') as packed:
+                for name, entry in sorted(packed_index.items()):
+                    if name in index:
+                        continue
+                    offset = f.tell()
+                    copy_range(packed, f, entry[0], entry[1])
+                    index[name] = [offset, entry[1], entry[2]]
+
+        index_data = json.dumps({'frames': index}).encode('utf-8')
+        index_offset = f.tell()
+        f.write(index_data)
+        f.write(FOOTER.pack(index_offset, len(index_data), MAGIC))
+
+    return index
+
+def load_index(archive_path):
+    with open(archive_path, 'rb') as f:
+        f.seek(-FOOTER.size, os.SEEK_END)
+        index_offset, index_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+        if magic != MAGIC:
+            raise IOError("%s is not a cache archive" % archive_path)
+
+        f.seek(index_offset)
+        return json.loads(f.read(index_length).decode('utf-8'))['frames']
+
+_indexes = {}
+
+def read_index(archive_path):
+    # {file name: [offset, size, mtime]} of an archive, or None if there is no archive,
+    # kept in memory until the archive changes
+    try:
+        stat = os.stat(archive_path)
+    except OSError:
+        return None
+
+    key = (stat.st_size, stat.st_mtime)
+    cached = _indexes.get(archive_path)
+    if cached is None or cached[0] != key:
+        try:
+            cached = (key, load_index(archive_path))
+        except (IOError, OSError, ValueError, struct.error) as e:
+            print("Unable to read the cache archive %s: %s" % (archive_path, e))
+            return None
+        _indexes[archive_path] = cached
+
+    return cached[1]
+
+def write_frame(archive_path, entry, frame_path):
+    # copies one frame out of an archive through a memory map, so only the pages of that frame are read
+    offset, size = entry[0], entry[1]
+    with open(archive_path, 'rb') as f, open(frame_path, 'wb') as frame:
+        if size == 0:
+            return
+
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for position in range(offset, offset + size, COPY_CHUNK_SIZE):
+                frame.write(mapped[position:min(position + COPY_CHUNK_SIZE, offset + size)])
+        finally:
+            mapped.close()
+
+def extract_frame(archive_path, entry, frame_path):
+    frame_dir = os.path.dirname(frame_path)
+    if not os.path.isdir(frame_dir):
+        os.makedirs(frame_dir)
+
+    # extracted under a temporary name and renamed, so a reader never sees half a frame
+    extract_path = os.path.join(frame_dir, '%s%s.%s.%s' % (EXTRACT_PREFIX, os.getpid(), threading.current_thread().ident, os.path.basename(frame_path)))
+    try:
+        write_frame(archive_path, entry, extract_path)
+        os.utime(extract_path, (time.time(), entry[2]))
+        if hasattr(os, 'replace'):
+            os.replace(extract_path, frame_path)
+        else:
+            if os.path.exists(frame_path):
+                os.remove(frame_path)
+            os.rename(extract_path, frame_path)
+    except (IOError, OSError):
+        if os.path.exists(extract_path):
+            os.remove(extract_path)
+        raise
+
+def get_packed_frame(cache_path):
+    # a local copy of a frame that's only in its version's archive, or None if it isn't packed
+    version_dir, name = os.path.split(cache_path)
+    archive_path = get_archive_path(version_dir)
+    index = read_index(archive_path)
+    if not index or name not in index:
+        return None
+
+    entry = index[name]
+    tier = local_cache.get_local_tier() or local_cache.get_tier(os.path.join(tempfile.gettempdir(), EXTRACT_DIR_NAME))
+    local_path = tier.get_local_path(cache_path)
+    if local_cache.is_copy_current(local_path, entry[1], entry[2]):
+        return local_path
+
+    try:
+        extract_frame(archive_path, entry, local_path)
+    except (IOError, OSError) as e:
+        print("Unable to extract %s from %s: %s" % (name, archive_path, e))
+        return None
+
+    tier.add_usage(entry[1])
+    return local_path
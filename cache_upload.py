@@ -0,0 +1,111 @@
+import os
+import tempfile
+import threading
+import time
+import local_cache
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# node local storage farm tasks write frames to before they're uploaded, the temp folder if unset
+SCRATCH_DIR_ENV = 'CACHE_SCRATCH_DIR'
+UPLOAD_THREADS_ENV = 'CACHE_UPLOAD_THREADS'
+DEFAULT_UPLOAD_THREADS = 2
+# frames waiting for an upload before the render is held up, so a fast sim can't fill the scratch disk
+UPLOADS_PER_THREAD = 4
+UPLOAD_ATTEMPTS = 3
+# seconds, multiplied by the attempt
+RETRY_DELAY = 5
+
+
+def get_scratch_path(cache_path):
+    scratch_root = os.environ.get(SCRATCH_DIR_ENV) or os.path.join(tempfile.gettempdir(), 'hou_cache_scratch')
+    return local_cache.mirror_path(scratch_root, cache_path)
+
+
+class Uploader(object):
+    # copies frames from scratch to their place on the network on a few background threads, retrying failed
+    # copies, and keeps track of what was uploaded so the render can check it all arrived before it finishes.
+    # publish(scratch_path, cache_path) does the copy itself
+    def __init__(self, publish, thread_count):
+        self.publish = publish
+        self.thread_count = thread_count
+        self.queue = queue.Queue(maxsize=thread_count * UPLOADS_PER_THREAD)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.uploaded = {}
+        self.failed = []
+
+    def start(self):
+        while len(self.threads) < self.thread_count:
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def upload(self, scratch_path, cache_path):
+        # blocks while the queue is full
+        self.start()
+        self.queue.put((scratch_path, cache_path))
+
+    def work(self):
+        while True:
+            scratch_path, cache_path = self.queue.get()
+            try:
+                size = self.upload_file(scratch_path, cache_path)
+                with self.lock:
+                    self.uploaded[cache_path] = size
+            except Exception as e:
+                with self.lock:
+                    self.failed.append((cache_path, str(e)))
+            finally:
+                self.queue.task_done()
+
+    def upload_file(self, scratch_path, cache_path):
+        size = os.path.getsize(scratch_path)
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                self.publish(scratch_path, cache_path)
+                uploaded_size = os.path.getsize(cache_path)
+                if uploaded_size != size:
+                    raise IOError("%s is %s bytes, expected %s" % (cache_path, uploaded_size, size))
+                break
+            except (IOError, OSError) as e:
+                if attempt == UPLOAD_ATTEMPTS:
+                    raise
+                print("Upload of %s failed, retrying: %s" % (cache_path, e))
+                time.sleep(RETRY_DELAY * attempt)
+
+        os.remove(scratch_path)
+        return size
+
+    def wait(self):
+        # [(cache path, error)] of the frames that didn't make it to the network since the last wait
+        self.queue.join()
+
+        with self.lock:
+            uploaded, self.uploaded = self.uploaded, {}
+            failed, self.failed = self.failed, []
+
+        # check again once everything is up, a frame can still be overwritten or removed by another task
+        for cache_path, size in sorted(uploaded.items()):
+            try:
+                uploaded_size = os.path.getsize(cache_path)
+            except OSError as e:
+                failed.append((cache_path, str(e)))
+                continue
+            if uploaded_size != size:
+                failed.append((cache_path, "%s bytes, expected %s" % (uploaded_size, size)))
+
+        return failed
+
+
+_uploader = None
+
+def get_uploader(publish):
+    global _uploader
+    if _uploader is None:
+        _uploader = Uploader(publish, max(1, int(os.environ.get(UPLOAD_THREADS_ENV, DEFAULT_UPLOAD_THREADS))))
+    return _uploader
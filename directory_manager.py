@@ -1,19 +1,284 @@
 import os
+import shutil
 import hou
+import cache_pack
+import cache_upload
+import local_cache
+import path_schema
+import prefetch
 
 
+class CachePathResolver(object):
+    # cache paths are evaluated by parm expressions on every frame of every cook, but only the frame changes
+    # between calls, so the path is compiled once per node and version into the text around the frame number
+    def __init__(self, version_parm):
+        self.version_parm = version_parm
+        self.compiled = {}
+        self.watched = set()
+        _resolvers.append(self)
+
+    def resolve(self, node):
+        return self.resolve_frame(node, get_frame())
+
+    def resolve_frame(self, node, frame):
+        schema = path_schema.get_schema()
+        state = (schema, node.evalParm(self.version_parm), get_wedge(schema))
+        compiled = self.compiled.get(node.sessionId())
+        if compiled is None or compiled[0] != state:
+            compiled = self.compile(node, state)
+
+        return compiled[1] + str(frame).zfill(compiled[3]) + compiled[2]
+
+    def compile(self, node, state):
+        watch_hip_file()
+        if node.sessionId() not in self.watched:
+            # $OS follows the node name, so a rename invalidates the node's path
+            node.addEventCallback((hou.nodeEventType.NameChanged, hou.nodeEventType.BeingDeleted), self.on_node_event)
+            self.watched.add(node.sessionId())
+
+        schema, version, wedge = state
+        prefix, suffix, padding = schema.split_at_frame(**get_cache_fields(node, version, wedge))
+        compiled = (state, prefix, suffix, padding)
+
+        self.compiled[node.sessionId()] = compiled
+        return compiled
+
+    def on_node_event(self, **kwargs):
+        session_id = kwargs['node'].sessionId()
+        self.compiled.pop(session_id, None)
+        if kwargs['event_type'] == hou.nodeEventType.BeingDeleted:
+            self.watched.discard(session_id)
+
+    def clear(self):
+        # node callbacks go away with the nodes when a hip file is cleared or loaded
+        self.compiled.clear()
+        self.watched.clear()
+
+_resolvers = []
+_watching_hip_file = False
+
+def get_frame():
+    # the frame cache paths are resolved at
+    return int(hou.expandString("$F"))
+
+def on_hip_file_event(event_type):
+    # $HIP changes when the scene is loaded, cleared or saved somewhere else
+    if event_type == hou.hipFileEventType.AfterSave:
+        for resolver in _resolvers:
+            resolver.compiled.clear()
+    elif event_type in (hou.hipFileEventType.AfterLoad, hou.hipFileEventType.AfterClear):
+        for resolver in _resolvers:
+            resolver.clear()
+        _read_paths.clear()
+
+def watch_hip_file():
+    global _watching_hip_file
+    if not _watching_hip_file:
+        hou.hipFile.addEventCallback(on_hip_file_event)
+        _watching_hip_file = True
+
+def get_wedge(schema):
+    # wedge ROPs set $WEDGENUM while they render each wedge
+    return hou.getenv("WEDGENUM", "") if schema.has_token('wedge') else ''
+
+def get_cache_fields(node, version, wedge=''):
+    # the fields of the path schema that come from the scene, by default the layout looks like
+    # W:/hou_cache/hipfiles/geo/pigcache/v1/pigcache.v1.1.bgeo.sc
+    return {'hip': hou.expandString("$HIP"), 'name': node.name(), 'version': version, 'wedge': wedge}
+
+sopoutput_resolver = CachePathResolver("cacheversion")
+read_cache_resolver = CachePathResolver("readcacheversion")
+
+# frames are written under a hidden name and renamed once complete when a node has this user data set
+ATOMIC_WRITES_KEY = "atomicwrites"
+STAGED_PREFIX = ".partial."
+ATOMIC_WRITES_HOOK = "import directory_manager; directory_manager.finalize_frame(hou.pwd())"
+# farm tasks write frames to local scratch and upload them in the background when a node has this user data set
+LOCAL_WRITES_KEY = "localwrites"
+LOCAL_WRITES_HOOK = "import directory_manager; directory_manager.finish_render(hou.pwd())"
+# set in the environment of cache job tasks, frames only go to staged files or scratch there
+FARM_TASK_ENV = "CACHE_FARM_TASK"
+
+def is_farm_task():
+    return bool(os.environ.get(FARM_TASK_ENV))
+
 def build_sopoutput(render_node):
-    # put together the path the cache will render to
-    hip_src = hou.expandString("$HIP")
-    cache_name = hou.expandString("$OS")
-    cache_version = hou.evalParm("cacheversion")
-    frame_number = hou.expandString("$F")
-    # create the cache file title here:
-    cache_file = "{}.v{}.{}.bgeo.sc".format(cache_name,cache_version,frame_number)
-    # cache_dir_full looks like this: W:/hou_cache/hipfiles/geo/pigcache/v1/pigcache.1.bgeo.sc
-    cache_dir_full = hip_src + '/geo/' + cache_name + '/' + 'v' + str(cache_version) + '/' + cache_file
-
-    return cache_dir_full
+    # put together the path the cache will render to, for the node evaluating the expression
+    node = hou.pwd()
+    cache_path = sopoutput_resolver.resolve(node)
+
+    # the submitter and artists rendering in a session get the real path
+    if is_farm_task():
+        if is_writing_locally(node):
+            return cache_upload.get_scratch_path(cache_path)
+        if node.userData(ATOMIC_WRITES_KEY):
+            return get_staged_path(cache_path)
+
+    # written in place, by a session, hbatch or a farm task without atomic writes
+    break_link(cache_path)
+    return cache_path
+
+def get_staged_path(cache_path):
+    # hidden, so readers and the cache index skip it, and keeping the extension houdini picks the format from
+    cache_dir, cache_file = os.path.split(cache_path)
+    return cache_dir + '/' + STAGED_PREFIX + cache_file
+
+def break_link(cache_path):
+    # a deduplicated frame is a hard link sharing its bytes with other versions, so before it's written in place it
+    # gets its own copy. only versions cached over again have linked frames, dedupe leaves the current one alone
+    try:
+        if os.stat(cache_path).st_nlink < 2:
+            return False
+    except OSError:
+        return False
+
+    staged_path = get_staged_path(cache_path)
+    shutil.copy2(cache_path, staged_path)
+    os.replace(staged_path, cache_path)
+    return True
+
+class SceneChanges(object):
+    # parms and user data changed for a submission. the scene is saved for the farm with the changes in it and then
+    # put back the way it was, so they don't stay in the artist's session or end up in their next save
+    def __init__(self):
+        self.undo = []
+
+    def add_undo(self, undo):
+        self.undo.append(undo)
+
+    def set_parm(self, parm, value):
+        keyframes = parm.keyframes()
+        if keyframes:
+            def undo():
+                parm.deleteAllKeyframes()
+                parm.setKeyframes(keyframes)
+            parm.deleteAllKeyframes()
+        else:
+            original = parm.unexpandedString() if parm.parmTemplate().type() == hou.parmTemplateType.String else parm.eval()
+            undo = lambda: parm.set(original)
+
+        self.undo.append(undo)
+        parm.set(value)
+
+    def set_user_data(self, node, key, value):
+        original = node.userData(key)
+        self.undo.append(lambda: set_user_data(node, key, original))
+        set_user_data(node, key, value)
+
+    def extend(self, changes):
+        self.undo.extend(changes.undo)
+        changes.undo = []
+
+    def restore(self):
+        # last change first, so something changed twice gets its original value back
+        while self.undo:
+            self.undo.pop()()
+
+def set_user_data(node, key, value):
+    if value is not None:
+        node.setUserData(key, value)
+    elif node.userData(key) is not None:
+        node.destroyUserData(key)
+
+def can_set_script(render_node, parm_name, script):
+    # the ROP has the script parm, and it's empty or already holds this script
+    parm = render_node.parm(parm_name)
+    if parm is None:
+        return False
+
+    current = parm.unexpandedString().strip()
+    return not current or current == script
+
+def set_script(render_node, parm_name, script, changes):
+    changes.set_parm(render_node.parm(parm_name), script)
+    if render_node.parm('l' + parm_name):
+        changes.set_parm(render_node.parm('l' + parm_name), 'python')
+    if render_node.parm('t' + parm_name):
+        changes.set_parm(render_node.parm('t' + parm_name), 1)
+
+def enable_atomic_writes(render_node, changes):
+    # readers only ever see complete frames: the ROP writes each frame to a staged file, and its post frame
+    # script flushes it to disk and renames it to the real name
+    if not can_set_script(render_node, 'postframe', ATOMIC_WRITES_HOOK):
+        print("%s has its own post frame script, writing frames in place" % render_node.path())
+        return False
+
+    set_script(render_node, 'postframe', ATOMIC_WRITES_HOOK, changes)
+    changes.set_user_data(render_node, ATOMIC_WRITES_KEY, '1')
+    return True
+
+def enable_local_writes(render_node, changes):
+    # sims aren't held up by the filer: farm tasks write each frame to local scratch, the post frame script
+    # queues it for upload, and the post render script waits until every frame is on the network
+    if not (can_set_script(render_node, 'postframe', ATOMIC_WRITES_HOOK) and can_set_script(render_node, 'postrender', LOCAL_WRITES_HOOK)):
+        print("%s has its own post frame or post render script, writing frames to the network" % render_node.path())
+        return False
+
+    set_script(render_node, 'postframe', ATOMIC_WRITES_HOOK, changes)
+    set_script(render_node, 'postrender', LOCAL_WRITES_HOOK, changes)
+    changes.set_user_data(render_node, LOCAL_WRITES_KEY, '1')
+    return True
+
+def is_writing_locally(render_node):
+    # only cache job tasks, artists rendering in a session or hbatch write straight to the network
+    return bool(render_node.userData(LOCAL_WRITES_KEY)) and is_farm_task()
+
+def commit_staged_file(staged_path, cache_path):
+    fd = os.open(staged_path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    if hasattr(os, 'replace'):
+        os.replace(staged_path, cache_path)
+    else:
+        # python 2 can't rename over an existing file on windows
+        if os.name == 'nt' and os.path.exists(cache_path):
+            os.remove(cache_path)
+        os.rename(staged_path, cache_path)
+
+    if os.name != 'nt':
+        # make the rename itself durable
+        dir_fd = os.open(os.path.dirname(cache_path), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def publish_frame(scratch_path, cache_path):
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    # uploaded under the staged name too, so readers never see half a frame
+    staged_path = get_staged_path(cache_path)
+    shutil.copyfile(scratch_path, staged_path)
+    commit_staged_file(staged_path, cache_path)
+
+def finalize_frame(render_node):
+    # post frame hook of ROPs with atomic or local writes, $F is the frame that was just written
+    cache_path = sopoutput_resolver.resolve(render_node)
+    if is_writing_locally(render_node):
+        cache_upload.get_uploader(publish_frame).upload(cache_upload.get_scratch_path(cache_path), cache_path)
+        return
+
+    staged_path = get_staged_path(cache_path)
+
+    if os.path.exists(staged_path):
+        commit_staged_file(staged_path, cache_path)
+
+def finish_render(render_node):
+    # post render hook of ROPs with local writes, the task only finishes once its frames are on the network
+    if not is_writing_locally(render_node):
+        return
+
+    failed = cache_upload.get_uploader(publish_frame).wait()
+    for cache_path, error in failed:
+        print("Unable to upload %s: %s" % (cache_path, error))
+
+    if failed:
+        raise hou.OperationFailed("%s frames of %s failed to upload" % (len(failed), render_node.path()))
 
 def create_directory(render_node):
     cache_dir_fullpath = render_node.evalParm("sopoutput")
@@ -26,28 +291,162 @@ def create_directory(render_node):
 
     return create_cache_dir
 
+def get_cache_root(render_node):
+    # versions live side by side in their own folders under the version root of the path schema
+    schema = path_schema.get_schema()
+    return schema.version_root(**get_cache_fields(render_node, render_node.evalParm("cacheversion"), get_wedge(schema)))
+
+def get_cache_version_dir(render_node, version):
+    schema = path_schema.get_schema()
+    return schema.version_dir(**get_cache_fields(render_node, version, get_wedge(schema))) + '/'
+
+def get_cache_versions(render_node):
+    cache_root = get_cache_root(render_node)
+    if not os.path.isdir(cache_root):
+        return []
+
+    schema = path_schema.get_schema()
+    versions = [schema.parse_version_dir(x, name=render_node.name()) for x in os.listdir(cache_root)]
+    return sorted(x for x in versions if x is not None)
+
+def get_next_cache_version(render_node):
+    versions = get_cache_versions(render_node)
+    if not versions:
+        return int(render_node.evalParm("cacheversion"))
+
+    return max(versions) + 1
+
+def build_checkpoint_path(render_node, sim_node):
+    # sim checkpoints go in the cache version folder so every version resumes from its own sim
+    checkpoint_dir = create_directory(render_node) + 'checkpoints/'
+
+    if not os.path.exists(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+
+    return checkpoint_dir + sim_node.name() + '.$SF.sim'
+
+# {node session id: (cache path, its mtime, path to read it from)} of the frame each file sop last read
+_read_paths = {}
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
 def read_in_cache_dir(render_node):
-    # get the path to read the cache in from
-    hip_src = hou.expandString("$HIP")
-    cache_name = hou.expandString("$OS")
-    read_cache_version = hou.evalParm("readcacheversion")
-    frame_number = hou.expandString("$F")
-    # source the cache file title here (this needs to match from build_sopoutput function above):
-    cache_file = "{}.v{}.{}.bgeo.sc".format(cache_name,read_cache_version,frame_number)
+    # get the path to read the cache in from (this needs to match build_sopoutput above)
+    node = hou.pwd()
+    frame = get_frame()
+    cache_path = read_cache_resolver.resolve_frame(node, frame)
+
+    # the expression is evaluated many times per cook, the frame is only looked up again when the path changes, the
+    # frame was cached again, or the copy it was read from was evicted
+    mtime = get_mtime(cache_path)
+    last_read = _read_paths.get(node.sessionId())
+    if last_read is not None and last_read[:2] == (cache_path, mtime):
+        read_path = last_read[2]
+        if (read_path == cache_path and mtime is not None) or os.path.exists(read_path):
+            return read_path
+
+    # warm the next frames in the background while the artist plays through the cache
+    prefetch.request(node, frame, lambda x: read_cache_resolver.resolve_frame(node, x))
+
+    if not os.path.exists(cache_path):
+        # frames of packed versions are only in the version's archive
+        read_path = cache_pack.get_packed_frame(cache_path) or cache_path
+    else:
+        # read through a copy on local disk when the local cache tier is set up
+        read_path = local_cache.fetch(cache_path)
+
+    _read_paths[node.sessionId()] = (cache_path, mtime, read_path)
+    return read_path
+
+def get_frame_files(render_node, version):
+    # [(frame, path)] of the loose frame files in a version folder
+    version_dir = get_cache_version_dir(render_node, version)
+    schema = path_schema.get_schema()
+    ext = path_schema.DEFAULT_FIELDS['ext']
+
+    frame_files = []
+    for entry in os.listdir(version_dir):
+        fields = None if entry.startswith('.') else schema.parse_filename(entry, name=render_node.name(), version=version, ext=ext)
+        if fields and 'frame' in fields:
+            frame_files.append((fields['frame'], version_dir + entry))
+
+    return sorted(frame_files)
+
+def pack_cache_version(render_node, version=None, keep_frames=False):
+    # packs the frames of a finished version into one archive, so listing or copying the version
+    # is one file for the filer instead of thousands
+    if version is None:
+        version = int(render_node.evalParm("cacheversion"))
+
+    archive_path = cache_pack.get_archive_path(get_cache_version_dir(render_node, version))
+    # frames cached again since the version was last packed are loose next to the archive, the new archive gets them
+    # and the rest of the old archive's frames
+    packed_index = cache_pack.read_index(archive_path)
+
+    frame_paths = [x[1] for x in get_frame_files(render_node, version)]
+    if not frame_paths:
+        if packed_index:
+            print("%s v%s is packed already" % (render_node.path(), version))
+            return archive_path
+        print("%s v%s has no frames to pack" % (render_node.path(), version))
+        return None
+
+    staged_path = get_staged_path(archive_path)
+    index = cache_pack.write_archive(staged_path, frame_paths, archive_path, packed_index)
+    commit_staged_file(staged_path, archive_path)
+
+    if cache_pack.load_index(archive_path) != index:
+        raise hou.OperationFailed("The archive %s doesn't match the frames packed into it" % archive_path)
+
+    if not keep_frames:
+        for frame_path in frame_paths:
+            os.remove(frame_path)
+
+    print("Packed %s frames of %s v%s into %s" % (len(index), render_node.path(), version, archive_path))
+    return archive_path
+
+def unpack_cache_version(render_node, version=None, keep_archive=False):
+    # writes the frames of a packed version back out as loose files, frames cached again since it was packed are kept
+    if version is None:
+        version = int(render_node.evalParm("cacheversion"))
+
+    version_dir = get_cache_version_dir(render_node, version)
+    archive_path = cache_pack.get_archive_path(version_dir)
+    index = cache_pack.read_index(archive_path)
+    if index is None:
+        print("%s v%s isn't packed" % (render_node.path(), version))
+        return 0
+
+    unpacked = 0
+    for name, entry in sorted(index.items()):
+        frame_path = version_dir + name
+        if os.path.exists(frame_path):
+            continue
+
+        staged_path = get_staged_path(frame_path)
+        cache_pack.write_frame(archive_path, entry, staged_path)
+        os.utime(staged_path, (os.stat(staged_path).st_atime, entry[2]))
+        commit_staged_file(staged_path, frame_path)
+        unpacked += 1
 
-    read_cache_dir = hip_src + '/geo/' + cache_name + '/' + 'v' + str(read_cache_version) + '/' + cache_file
+    if not keep_archive:
+        os.remove(archive_path)
 
-    return read_cache_dir
+    return unpacked
 
 def get_txt_file(render_node):
     # get the path to read in the txt file from
-    hip_src = hou.expandString("$HIP")
-    cache_name = hou.expandString("$OS")
-    cache_version = hou.evalParm("reviewcacheversion")
+    node = hou.pwd()
+    cache_version = node.evalParm("reviewcacheversion")
 
     cache_txt_file = "cache_settings.txt"
 
-    cache_txt_dir = hip_src + '/geo/' + cache_name + '/' + 'v' + str(cache_version) + '/' + cache_txt_file
+    schema = path_schema.get_schema()
+    cache_txt_dir = schema.version_dir(**get_cache_fields(node, cache_version, get_wedge(schema))) + '/' + cache_txt_file
 
     return cache_txt_dir
 
@@ -0,0 +1,96 @@
+import json
+import os
+import hou
+import cache_index
+import directory_manager
+import task_history
+
+# rules for the storage the caches are written to, see load_io_rules
+IO_RULES_FILE = os.environ.get('CACHE_IO_RULES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache_io_rules.json'))
+# fills in what a matching rule leaves out, caches no rule matches aren't limited
+DEFAULT_IO_RULE = {'root': '', 'bandwidth': 800, 'headroom': 0.8, 'limits': ''}
+
+
+def load_io_rules(rules_file=IO_RULES_FILE):
+    # the rules file is a json list of storage roots and what their filer can take, ie.
+    # [{"root": "W:/hou_cache", "bandwidth": 1200, "headroom": 0.8, "limits": "filer_w"}]
+    # bandwidth is the MB/s the filer saturates at, headroom the share of it caches may use together,
+    # and limits the Deadline limit groups every cache job writing there is added to
+    if not os.path.isfile(rules_file):
+        return []
+
+    try:
+        with open(rules_file, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        print("Unable to read the cache IO rules from %s: %s" % (rules_file, e))
+        return []
+
+def normalize_path(path):
+    return os.path.normcase(os.path.normpath(path)).replace('\\', '/')
+
+def find_io_rule(cache_path, rules):
+    # the rule with the longest root containing the cache wins
+    cache_path = normalize_path(cache_path)
+    matches = [x for x in rules if x.get('root') and (cache_path + '/').startswith(normalize_path(x['root']).rstrip('/') + '/')]
+    if not matches:
+        return None
+
+    rule = dict(DEFAULT_IO_RULE)
+    rule.update(max(matches, key=lambda x: len(normalize_path(x['root']))))
+    return rule
+
+def get_previous_version(render_node):
+    current_version = int(render_node.evalParm('cacheversion'))
+    versions = [x for x in directory_manager.get_cache_versions(render_node) if x < current_version]
+    return max(versions) if versions else None
+
+def get_mean_frame_bytes(render_node, version):
+    version_dir = directory_manager.get_cache_version_dir(render_node, version)
+    sizes = [x[0] for x in cache_index.scan_version_frames(version_dir, render_node.name(), version).values()]
+
+    if not sizes:
+        return None
+    return sum(sizes) / float(len(sizes))
+
+def estimate_write_bandwidth(render_node):
+    # MB/s a single task writes, from the previous version's frame sizes and how long its tasks took per frame
+    previous_version = get_previous_version(render_node)
+    if previous_version is None:
+        return None
+
+    frame_bytes = get_mean_frame_bytes(render_node, previous_version)
+    seconds_per_frame = task_history.get_recorded_seconds_per_frame(hou.hipFile.path(), render_node.path(), render_node.type().name())
+    if not frame_bytes or not seconds_per_frame:
+        return None
+
+    return frame_bytes / seconds_per_frame / (1024.0 * 1024.0)
+
+def configure_io_limits(render_node, jobProperties, rules=None):
+    rule = find_io_rule(render_node.evalParm('sopoutput'), load_io_rules() if rules is None else rules)
+    if rule is None:
+        return
+
+    if rule.get('limits'):
+        limits = [x for x in jobProperties.get('limits', '').split(',') if x]
+        limits.extend(x for x in rule['limits'].split(',') if x and x not in limits)
+        jobProperties['limits'] = ','.join(limits)
+
+    try:
+        task_bandwidth = estimate_write_bandwidth(render_node)
+    except Exception as e:
+        print("Unable to estimate the write bandwidth of %s: %s" % (render_node.path(), e))
+        task_bandwidth = None
+
+    if not task_bandwidth:
+        return
+
+    # as many machines as keep the writers together under the filer's saturation point
+    writers_per_machine = max(1, int(jobProperties.get('concurrent', 1)))
+    machines = max(1, int(rule['bandwidth'] * rule['headroom'] / (task_bandwidth * writers_per_machine)))
+
+    machine_limit = int(jobProperties.get('machinelimit', 0))
+    if machine_limit == 0 or machines < machine_limit:
+        jobProperties['machinelimit'] = machines
+
+    print("%s writes about %.1f MB/s per task, limiting it to %s machines" % (render_node.path(), task_bandwidth, jobProperties['machinelimit']))
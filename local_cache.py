@@ -0,0 +1,254 @@
+import os
+import shutil
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# a local folder, ie. an SSD, that cache frames read from the network are copied to and read from instead,
+# the tier is off unless this is set
+LOCAL_TIER_ENV = 'CACHE_LOCAL_TIER'
+# GB the tier may hold before the least recently used frames are evicted
+LOCAL_TIER_BUDGET_ENV = 'CACHE_LOCAL_TIER_GB'
+DEFAULT_BUDGET_GB = 100
+# evicting goes down to this share of the budget, so it doesn't run again on the next copy
+EVICT_TARGET = 0.9
+# other processes copy into the same tier, so its real size is rescanned every this many copies
+RESCAN_INTERVAL = 50
+# copies are serialized per frame through one of this many lock files, so the tier isn't littered with them
+LOCK_STRIPES = 64
+LOCK_DIR_NAME = '.locks'
+EVICT_LOCK_NAME = '.evict.lock'
+FETCH_PREFIX = '.fetch.'
+# frames being copied into the tier have hidden temporary names, they're only evicted once they're older than this
+# many seconds, which only happens to copies a crashed process left behind
+STALE_TEMP_AGE = 60 * 60
+# copies keep the network file's mtime, allowing for the float round trip through os.utime
+MTIME_TOLERANCE = 0.01
+
+
+def mirror_path(root, path):
+    # W:/hou_cache/geo/pig/v1/pig.v1.1.bgeo.sc -> <root>/W/hou_cache/geo/pig/v1/pig.v1.1.bgeo.sc
+    drive, rest = os.path.splitdrive(os.path.abspath(path))
+    relative = (drive + rest).replace('\\', '/').replace(':', '').lstrip('/')
+    return os.path.join(root, relative)
+
+def is_copy_current(local_path, size, mtime):
+    # a local copy is only used while it has the size and mtime of what it was copied from
+    try:
+        local_stat = os.stat(local_path)
+    except OSError:
+        return False
+
+    if local_stat.st_size != size or abs(local_stat.st_mtime - mtime) > MTIME_TOLERANCE:
+        return False
+
+    # the access time is what eviction goes by, set by hand as the tier may be mounted noatime
+    os.utime(local_path, (time.time(), local_stat.st_mtime))
+    return True
+
+
+class FileLock(object):
+    # an exclusive lock on a file shared by every process using the tier
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+
+    def acquire(self, blocking=True):
+        self.handle = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                self.handle.seek(0)
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except (IOError, OSError):
+            self.handle.close()
+            self.handle = None
+            return False
+        return True
+
+    def release(self):
+        if self.handle is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+            else:
+                self.handle.seek(0)
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        if not self.acquire():
+            raise IOError("Unable to lock %s" % self.path)
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class LocalTier(object):
+    # a read-through copy of network cache frames on local disk, kept under a byte budget by evicting the least
+    # recently used frames. the copies mirror the network paths and keep their size and mtime, so a copy is
+    # only reused while it still matches the network file
+    def __init__(self, root, budget):
+        self.root = root
+        self.budget = budget
+        self.used = None
+        self.copies = 0
+
+    def get_local_path(self, remote_path):
+        return mirror_path(self.root, remote_path)
+
+    def get_copy_lock(self, local_path):
+        lock_dir = os.path.join(self.root, LOCK_DIR_NAME)
+        if not os.path.isdir(lock_dir):
+            os.makedirs(lock_dir)
+        return FileLock(os.path.join(lock_dir, '%s.lock' % ((zlib.crc32(local_path.encode('utf-8')) & 0xffffffff) % LOCK_STRIPES)))
+
+    def is_current(self, local_path, remote_stat):
+        return is_copy_current(local_path, remote_stat.st_size, remote_stat.st_mtime)
+
+    def copy(self, remote_path, local_path, remote_stat):
+        local_dir = os.path.dirname(local_path)
+        if not os.path.isdir(local_dir):
+            os.makedirs(local_dir)
+
+        # copied under a temporary name and renamed, so a reader never sees half a frame
+        fetch_path = os.path.join(local_dir, '%s%s.%s' % (FETCH_PREFIX, os.getpid(), os.path.basename(local_path)))
+        try:
+            shutil.copy2(remote_path, fetch_path)
+            os.utime(fetch_path, (time.time(), remote_stat.st_mtime))
+            if hasattr(os, 'replace'):
+                os.replace(fetch_path, local_path)
+            else:
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+                os.rename(fetch_path, local_path)
+        except (IOError, OSError):
+            if os.path.exists(fetch_path):
+                os.remove(fetch_path)
+            raise
+
+    def fetch(self, remote_path):
+        # the local copy of a network file, copying it over first if it's missing or out of date
+        try:
+            remote_stat = os.stat(remote_path)
+        except OSError:
+            # not cached yet, houdini reports the missing file itself
+            return remote_path
+
+        local_path = self.get_local_path(remote_path)
+        if self.is_current(local_path, remote_stat):
+            return local_path
+
+        if remote_stat.st_size > self.budget:
+            return remote_path
+
+        with self.get_copy_lock(local_path):
+            # another process may have copied it while this one waited for the lock
+            if not self.is_current(local_path, remote_stat):
+                self.copy(remote_path, local_path, remote_stat)
+                self.add_usage(remote_stat.st_size)
+
+        return local_path
+
+    def add_usage(self, size):
+        self.copies += 1
+        if self.used is None or self.copies % RESCAN_INTERVAL == 0:
+            self.used = None
+        else:
+            self.used += size
+
+        if self.used is None or self.used > self.budget:
+            self.evict()
+
+    def list_files(self):
+        # (atime, size, path) of every file in the tier that can be evicted
+        files = []
+        now = time.time()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if LOCK_DIR_NAME in dirnames:
+                dirnames.remove(LOCK_DIR_NAME)
+            for filename in filenames:
+                if filename == EVICT_LOCK_NAME:
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                # copies are written under hidden names, ie. FETCH_PREFIX, and renamed once complete. the ctime
+                # moves with every write and the final utime, while the mtime is set back to the network file's
+                if filename.startswith('.'):
+                    if now - stat.st_ctime < STALE_TEMP_AGE:
+                        continue
+                    # oldest first
+                    files.append((0, stat.st_size, path))
+                    continue
+
+                files.append((stat.st_atime, stat.st_size, path))
+        return files
+
+    def evict(self):
+        lock = FileLock(os.path.join(self.root, EVICT_LOCK_NAME))
+        if not lock.acquire(blocking=False):
+            # another process is evicting already
+            return
+
+        try:
+            files = self.list_files()
+            self.used = sum(x[1] for x in files)
+            if self.used <= self.budget:
+                return
+
+            target = self.budget * EVICT_TARGET
+            for atime, size, path in sorted(files):
+                if self.used <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # still open by a reader on windows
+                    continue
+                self.used -= size
+        finally:
+            lock.release()
+
+
+_tiers = {}
+
+def get_local_tier():
+    root = os.environ.get(LOCAL_TIER_ENV)
+    if not root:
+        return None
+    return get_tier(root)
+
+def get_tier(root):
+    budget = int(float(os.environ.get(LOCAL_TIER_BUDGET_ENV, DEFAULT_BUDGET_GB)) * 1024 * 1024 * 1024)
+    key = (root, budget)
+    if key not in _tiers:
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        _tiers[key] = LocalTier(root, budget)
+    return _tiers[key]
+
+def fetch(remote_path):
+    # the path to read a network cache file from, the network path itself if there's no local tier
+    tier = get_local_tier()
+    if tier is None:
+        return remote_path
+
+    try:
+        return tier.fetch(remote_path)
+    except (IOError, OSError) as e:
+        print("Unable to copy %s to the local cache tier: %s" % (remote_path, e))
+        return remote_path
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local export of IFD/ASS/RS/vrscene files in a pool of headless hython processes, so exporting doesn't freeze
+the artist's Houdini session or run on a single core.
+
+The saved hip file is loaded by every worker, and each worker exports one contiguous slice of the frames.
+This file is also the worker script:
+hython local_export.py <hip> <rop> <frames> [--scene-path path] [--ignore-inputs] [--set parm=value]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+POLL_INTERVAL = 0.25
+
+def get_hython_path():
+    import hou
+    hython = os.path.join( hou.getenv( "HFS" ), "bin", "hython" )
+    if os.name == "nt":
+        hython += ".exe"
+    return hython
+
+def get_hip_to_export():
+    """
+    :return: The path of a hip file holding the current scene and whether it is a temporary copy. The scene file
+             itself is used when it has been saved, otherwise the scene is written to a backup so the artist's file
+             is left alone. The backup is in the backup folder, so workers loading it have to be given the scene's
+             own path to keep $HIP pointing at the scene's folder.
+    """
+    import hou
+    if hou.hipFile.hasUnsavedChanges():
+        return hou.hipFile.saveAsBackup(), True
+    return hou.hipFile.path(), False
+
+def set_scene_path( scenePath ):
+    """
+    Points $HIP, $HIPFILE and $HIPNAME at the given scene path, so a copy of a scene evaluates like the scene.
+    """
+    import hou
+    hipName = os.path.splitext( os.path.basename( scenePath ) )[ 0 ]
+    for name, value in ( ( "HIP", os.path.dirname( scenePath ) ), ( "HIPFILE", scenePath ), ( "HIPNAME", hipName ) ):
+        value = value.replace( "\\", "/" )
+        hou.hscript( "set -g %s = '%s'" % ( name, value ) )
+        hou.putenv( name, value )
+
+def split_frame_ranges( frameRanges, sliceCount ):
+    """
+    Splits ( start, end, step ) ranges into at most sliceCount contiguous slices with a similar number of frames.
+    :return: A list of slices, each a list of ( start, end, step ) ranges
+    """
+    frameCount = sum( abs( end - start ) // abs( step ) + 1 for start, end, step in frameRanges )
+    sliceCount = max( 1, min( sliceCount, frameCount ) )
+    sliceSize, remainder = divmod( frameCount, sliceCount )
+
+    slices = []
+    currentSlice = []
+    currentSize = 0
+    for start, end, step in frameRanges:
+        while True:
+            targetSize = sliceSize + ( 1 if len( slices ) < remainder else 0 )
+            available = abs( end - start ) // abs( step ) + 1
+            taken = min( available, targetSize - currentSize )
+            sliceEnd = start + ( taken - 1 ) * step
+            currentSlice.append( ( start, sliceEnd, step ) )
+            currentSize += taken
+
+            if currentSize == targetSize:
+                slices.append( currentSlice )
+                currentSlice = []
+                currentSize = 0
+
+            if taken == available:
+                break
+            start = sliceEnd + step
+
+    if currentSlice:
+        slices.append( currentSlice )
+
+    return slices
+
+def format_frame_ranges( frameRanges ):
+    return ",".join( "%s:%s:%s" % frameRange for frameRange in frameRanges )
+
+def parse_frame_ranges( frameRanges ):
+    return [ tuple( int( value ) for value in frameRange.split( ":" ) ) for frameRange in frameRanges.split( "," ) ]
+
+def export_frames( node, frameRanges, ignoreInputs=False, processCount=2, parmOverrides=None ):
+    """
+    Exports the given frames of a ROP in background hython processes and waits for them to finish, keeping the
+    session responsive and allowing the export to be interrupted.
+    :param node: The ROP to export
+    :param frameRanges: The ( start, end, step ) ranges of the frames to export
+    :param ignoreInputs: Whether the ROP's inputs should be rendered
+    :param processCount: The maximum number of hython processes to run at once
+    :param parmOverrides: Parameter name to unexpanded value overrides, applied on the ROP in the workers only
+    :raise hou.OperationFailed: If a worker fails or the export is interrupted
+    """
+    import hou
+
+    hipPath, isTemporary = get_hip_to_export()
+    slices = split_frame_ranges( frameRanges, processCount )
+
+    commands = []
+    for frameSlice in slices:
+        command = [ get_hython_path(), os.path.abspath( __file__ ), hipPath, node.path(), format_frame_ranges( frameSlice ) ]
+        if isTemporary:
+            command.extend( [ "--scene-path", hou.hipFile.path() ] )
+        if ignoreInputs:
+            command.append( "--ignore-inputs" )
+        for parmName, value in ( parmOverrides or {} ).items():
+            command.extend( [ "--set", "%s=%s" % ( parmName, value ) ] )
+        commands.append( command )
+
+    print( "Exporting %s locally in %s hython processes" % ( node.path(), len( commands ) ) )
+
+    processes = []
+    try:
+        with hou.InterruptableOperation( "Exporting %s" % node.path(), open_interrupt_dialog=True ) as operation:
+            processes = [ subprocess.Popen( command ) for command in commands ]
+            while True:
+                finished = [ process for process in processes if process.poll() is not None ]
+                operation.updateProgress( float( len( finished ) ) / len( processes ) )
+                if len( finished ) == len( processes ):
+                    break
+                time.sleep( POLL_INTERVAL )
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        if isTemporary:
+            try:
+                os.remove( hipPath )
+            except OSError:
+                pass
+
+    failed = [ format_frame_ranges( frameSlice ) for frameSlice, process in zip( slices, processes ) if process.returncode != 0 ]
+    if failed:
+        raise hou.OperationFailed( "Local export of %s failed for frames %s" % ( node.path(), ", ".join( failed ) ) )
+
+def main():
+    parser = argparse.ArgumentParser( description="Exports frames of a ROP from a hip file." )
+    parser.add_argument( "hip" )
+    parser.add_argument( "rop" )
+    parser.add_argument( "frames", help="start:end:step ranges separated by commas" )
+    parser.add_argument( "--scene-path", help="the path of the scene the hip file is a copy of" )
+    parser.add_argument( "--ignore-inputs", action="store_true" )
+    parser.add_argument( "--set", action="append", default=[], help="parm=value to set on the ROP before exporting" )
+    args = parser.parse_args()
+
+    import hou
+    hou.hipFile.load( args.hip, suppress_save_prompt=True, ignore_load_warnings=True )
+    if args.scene_path:
+        set_scene_path( args.scene_path )
+
+    node = hou.node( args.rop )
+    if node is None:
+        print( "ROP %s does not exist in %s" % ( args.rop, args.hip ) )
+        return 1
+
+    for override in args.set:
+        parmName, value = override.split( "=", 1 )
+        node.parm( parmName ).set( value )
+
+    for frameRange in parse_frame_ranges( args.frames ):
+        node.render( frameRange, (), ignore_inputs=args.ignore_inputs )
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main() )
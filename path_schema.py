@@ -0,0 +1,165 @@
+import os
+import re
+import hou
+
+# the layout caches are written in, tokens are {hip}, {name}, {version}, {frame}, {wedge} and {ext},
+# numbers can be padded like {frame:4}, and $VARIABLES in the rest of the template are expanded by houdini
+DEFAULT_TEMPLATE = "{hip}/geo/{name}/v{version}/{name}.v{version}.{frame}.{ext}"
+# a studio can switch layouts by setting this, ie. to $JOB/cache/{name}/v{version}/{name}.v{version}.{frame:4}.{ext}
+TEMPLATE_ENV = 'CACHE_PATH_TEMPLATE'
+
+TOKEN_REGEX = re.compile(r"\{(hip|name|version|frame|wedge|ext)(?::([0-9]+))?\}")
+NUMBER_TOKENS = ('version', 'frame', 'wedge')
+DEFAULT_FIELDS = {'ext': 'bgeo.sc', 'wedge': ''}
+# what each token matches when parsing a path back into its fields
+TOKEN_PATTERNS = {
+    'hip': '.+',
+    'name': '[^/]+?',
+    'version': '[0-9]+',
+    'frame': '-?[0-9]+',
+    'wedge': '[0-9]*',
+    'ext': '[^/]+',
+}
+
+
+def expand_text(text):
+    return hou.expandString(text) if '$' in text else text
+
+def parse_component(component):
+    # a path component as a list of ('text', text) and ('token', name, padding) segments
+    segments = []
+    position = 0
+    for match in TOKEN_REGEX.finditer(component):
+        if match.start() > position:
+            segments.append(('text', component[position:match.start()]))
+        segments.append(('token', match.group(1), int(match.group(2) or 0)))
+        position = match.end()
+
+    if position < len(component):
+        segments.append(('text', component[position:]))
+
+    return segments
+
+def format_token(name, padding, fields, unpadded=()):
+    value = fields[name]
+    if name in NUMBER_TOKENS and value != '' and name not in unpadded:
+        return str(value).zfill(padding)
+    return str(value)
+
+
+class PathSchema(object):
+    # a cache path template parsed once into segments, which formats paths and parses them back into fields
+    def __init__(self, template):
+        self.template = template
+        self.components = [parse_component(x) for x in template.split('/')]
+        self.regexes = {}
+
+        self.version_index = None
+        for i, segments in enumerate(self.components):
+            if any(x[0] == 'token' and x[1] == 'version' for x in segments):
+                self.version_index = i
+                break
+
+    def has_token(self, name):
+        return any(x[0] == 'token' and x[1] == name for segments in self.components for x in segments)
+
+    def fields(self, fields):
+        result = dict(DEFAULT_FIELDS)
+        result.update(fields)
+        return result
+
+    def format_components(self, components, fields, unpadded=()):
+        parts = []
+        for segments in components:
+            parts.append(''.join(expand_text(x[1]) if x[0] == 'text' else format_token(x[1], x[2], fields, unpadded) for x in segments))
+        return '/'.join(parts)
+
+    def format(self, **fields):
+        return self.format_components(self.components, self.fields(fields))
+
+    def split_at_frame(self, **fields):
+        # the path before and after the frame number, and the frame padding, so frames are a concatenation away
+        if not self.has_token('frame'):
+            raise ValueError("The cache path template %s has no {frame} token" % self.template)
+
+        marker = '\0'
+        fields = self.fields(fields)
+        fields['frame'] = marker
+        padding = 0
+        for segments in self.components:
+            for x in segments:
+                if x[0] == 'token' and x[1] == 'frame':
+                    padding = x[2]
+
+        # the marker goes in as it is, the caller pads the frame number itself
+        prefix, _, suffix = self.format_components(self.components, fields, unpadded=('frame',)).partition(marker)
+        return prefix, suffix, padding
+
+    def version_dir(self, **fields):
+        # the folder a version's frames are written to
+        return os.path.dirname(self.format(frame=0, **fields))
+
+    def version_root(self, **fields):
+        # the folder holding every version's folder
+        if self.version_index is None:
+            raise ValueError("The cache path template %s has no {version} token" % self.template)
+
+        return self.format_components(self.components[:self.version_index], self.fields(fields))
+
+    def component_regex(self, components, known_fields):
+        key = (len(components), tuple(sorted(known_fields.items())))
+        if key not in self.regexes:
+            pattern = []
+            seen = set()
+            for segments in components:
+                part = ''
+                for x in segments:
+                    if x[0] == 'text':
+                        part += re.escape(expand_text(x[1]))
+                    elif x[1] in known_fields:
+                        part += re.escape(format_token(x[1], x[2], known_fields))
+                    elif x[1] in seen:
+                        part += '(?P=%s)' % x[1]
+                    else:
+                        part += '(?P<%s>%s)' % (x[1], TOKEN_PATTERNS[x[1]])
+                        seen.add(x[1])
+                pattern.append(part)
+            self.regexes[key] = re.compile('^' + '/'.join(pattern) + '$')
+
+        return self.regexes[key]
+
+    def match_fields(self, regex, path):
+        match = regex.match(path.replace('\\', '/'))
+        if match is None:
+            return None
+
+        fields = match.groupdict()
+        for name in NUMBER_TOKENS:
+            if fields.get(name):
+                fields[name] = int(fields[name])
+        return fields
+
+    def parse(self, path, **known_fields):
+        # the fields of a full path, or None if the path doesn't follow the schema
+        return self.match_fields(self.component_regex(self.components, known_fields), path)
+
+    def parse_filename(self, filename, **known_fields):
+        # the fields of a file name on its own, for scanning a version folder
+        return self.match_fields(self.component_regex(self.components[-1:], known_fields), filename)
+
+    def parse_version_dir(self, dirname, **known_fields):
+        # the version of a folder in the version root, or None if it isn't a version folder
+        if self.version_index is None:
+            return None
+
+        fields = self.match_fields(self.component_regex(self.components[self.version_index:self.version_index + 1], known_fields), dirname)
+        return fields.get('version') if fields else None
+
+
+_schemas = {}
+
+def get_schema(template=None):
+    template = template or os.environ.get(TEMPLATE_ENV) or DEFAULT_TEMPLATE
+    if template not in _schemas:
+        _schemas[template] = PathSchema(template)
+    return _schemas[template]
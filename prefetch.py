@@ -0,0 +1,129 @@
+import collections
+import os
+import threading
+import hou
+import cache_pack
+import local_cache
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# frames read ahead of the playhead in interactive sessions, 0 turns read ahead off
+PREFETCH_FRAMES_ENV = 'CACHE_PREFETCH_FRAMES'
+DEFAULT_PREFETCH_FRAMES = 8
+PREFETCH_THREADS = 2
+# reads to warm the page cache are made in chunks this big, checking in between whether they're still wanted
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+# files warmed recently are not read again
+WARMED_HISTORY = 1024
+
+
+class Prefetcher(object):
+    # warms the frames after the one being read in the direction playback is going, on a few background threads.
+    # frames go into the local cache tier if there is one, otherwise they're read once so the OS page cache has them.
+    # every change of direction or jump starts a new generation, and queued frames of older generations are dropped
+    def __init__(self, frame_count, thread_count=PREFETCH_THREADS):
+        self.frame_count = frame_count
+        self.thread_count = thread_count
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.last_frames = {}
+        self.directions = {}
+        self.generations = {}
+        self.pending = {}
+        self.warmed = collections.OrderedDict()
+
+    def start(self):
+        while len(self.threads) < self.thread_count:
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def request(self, key, frame, get_path):
+        # key is what's being read, ie. a node, and get_path gives the path of its other frames
+        with self.lock:
+            last_frame = self.last_frames.get(key)
+            direction = self.directions.get(key, 1)
+            generation = self.generations.get(key, 0)
+
+            if last_frame is not None:
+                step = frame - last_frame
+                if step == 0:
+                    return
+                if abs(step) > self.frame_count:
+                    # the playhead jumped, what was queued for where it was is no use anymore
+                    generation += 1
+                elif (step > 0) != (direction > 0):
+                    direction = -direction
+                    generation += 1
+
+            self.last_frames[key] = frame
+            self.directions[key] = direction
+            self.generations[key] = generation
+
+        paths = [get_path(frame + direction * i) for i in range(1, self.frame_count + 1)]
+
+        self.start()
+        with self.lock:
+            for path in paths:
+                if path in self.warmed or self.pending.get(path) == (key, generation):
+                    continue
+                self.pending[path] = (key, generation)
+                self.queue.put((key, generation, path))
+
+    def is_current(self, key, generation):
+        return self.generations.get(key) == generation
+
+    def work(self):
+        while True:
+            key, generation, path = self.queue.get()
+            try:
+                if self.is_current(key, generation) and self.warm(key, generation, path):
+                    with self.lock:
+                        self.warmed[path] = True
+                        while len(self.warmed) > WARMED_HISTORY:
+                            self.warmed.popitem(last=False)
+            except Exception as e:
+                print("Unable to read ahead %s: %s" % (path, e))
+            finally:
+                with self.lock:
+                    if self.pending.get(path) == (key, generation):
+                        del self.pending[path]
+
+    def warm(self, key, generation, path):
+        if not os.path.isfile(path):
+            # packed, past the end of the cache, or not written yet
+            return cache_pack.get_packed_frame(path) is not None
+
+        if local_cache.get_local_tier() is not None:
+            return local_cache.fetch(path) != path
+
+        with open(path, 'rb') as f:
+            while f.read(READ_CHUNK_SIZE):
+                if not self.is_current(key, generation):
+                    return False
+        return True
+
+
+_prefetcher = None
+
+def get_prefetcher():
+    global _prefetcher
+    if _prefetcher is None:
+        frame_count = int(os.environ.get(PREFETCH_FRAMES_ENV, DEFAULT_PREFETCH_FRAMES))
+        # farm renders read each frame once, only playback benefits
+        if frame_count <= 0 or not hou.isUIAvailable():
+            _prefetcher = False
+        else:
+            _prefetcher = Prefetcher(frame_count)
+
+    return _prefetcher or None
+
+def request(node, frame, get_path):
+    prefetcher = get_prefetcher()
+    if prefetcher is not None:
+        prefetcher.request(node.sessionId(), frame, get_path)
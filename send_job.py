@@ -1,11 +1,23 @@
 import sys
 import os
 import json
+import time
 import traceback
 import hou
+import math
 import SubmitHoudiniToDeadlineFunctions
+import directory_manager
+import io_limits
+import parm_handler
 from CallDeadlineCommand import CallDeadlineCommand
 
+# machines a frame independent cache is spread over when the job has no machine limit
+DEFAULT_CACHE_SHARDS = 10
+# node types which make a cache depend on the previous frame, on top of the ones found by parm_handler
+SIM_NODE_TYPES = ('solver', 'dopimport')
+# frames simulated per job when a sim cache is split into windows resuming from checkpoints
+SIM_WINDOW_FRAMES = 100
+
 
 def create_job_dict(render_node):
 
@@ -36,9 +48,15 @@ def create_job_dict(render_node):
     'overrideframes': 1,
     'framelist': framelist,
     'framespertask': 9999,
+    'atomicwrites': 1,
+    'localwrites': 0,
+    'adaptivechunksize': 0,
+    'chunktargetminutes': (10, 20),
     'bits': '64bit',
     'submitscene': 0,
     'isframedependent': 0,
+    'frameorder': 'linear',
+    'environment': {directory_manager.FARM_TASK_ENV: '1'},
     'gpuopenclenable': 0,
     'gpuspertask': 0,
     'gpudevices': '',
@@ -124,6 +142,8 @@ def create_job_dict(render_node):
     'vraythreads': 0, 
     'vrayarguments': '', 
     'vraylocalexport': False, 
+    'localexportprocesses': 0,
+    'reuseexports': 0,
     'tilesenabled': 0,
     'tilesinx': 3, 
     'tilesiny': 3,
@@ -139,14 +159,178 @@ def create_job_dict(render_node):
     'erroronmissingbackground': '0',
     'cleanuptiles': '1'
     }
+
+    # cache nodes with a local writes toggle write each frame to scratch on the farm and upload it from there
+    if render_node.parm('localwrites'):
+        jobProperties['localwrites'] = int(render_node.evalParm('localwrites'))
     return jobProperties
 
 
-def run_job_cmd(render_node):
+def get_cache_sop(render_node):
+    # ROPs writing a SOP cache point at it with soppath, file cache SOPs are the cache themselves
+    if render_node.parm('soppath'):
+        sop = render_node.node(render_node.evalParm('soppath'))
+        if sop:
+            return sop
+    return render_node
+
+def is_frame_independent(render_node):
+    # simulations have to cook every frame in order on one machine
+    if render_node.parm('initsim') and render_node.evalParm('initsim'):
+        return False
+
+    cache_sop = get_cache_sop(render_node)
+    if parm_handler.get_all_eval_nodes({'node': cache_sop}):
+        return False
+
+    for node in cache_sop.inputAncestors():
+        if any(sim_type in node.type().name() for sim_type in SIM_NODE_TYPES):
+            return False
+
+    return True
+
+def get_cache_chunk_size(render_node, jobProperties):
+    frame_ranges = SubmitHoudiniToDeadlineFunctions.parse_frame_ranges(jobProperties['framelist'])
+    frame_count = SubmitHoudiniToDeadlineFunctions.count_frame_ranges(frame_ranges)
+
+    # spread the frames evenly over the machines the job may use
+    machines = int(jobProperties.get('machinelimit', 0)) or DEFAULT_CACHE_SHARDS
+    return max(1, int(math.ceil(frame_count / float(machines))))
+
+def get_sim_dopnets(sim_nodes):
+    # pyro solvers run their own dop network inside
+    dopnets = []
+    for node in sim_nodes:
+        if 'dopnet' in node.type().name():
+            dopnets.append(node)
+        else:
+            dopnets.extend(x for x in node.allSubChildren() if 'dopnet' in x.type().name())
+    return dopnets
+
+def enable_sim_checkpoints(render_node, dopnets, window_frames, changes):
+    # checkpoint once per window, at the frame the next window resumes from. two are kept, so a window retried
+    # while the next one has written its own checkpoint can still resume
+    checkpoint_changes = directory_manager.SceneChanges()
+    try:
+        for dopnet in dopnets:
+            checkpoint_changes.set_parm(dopnet.parm('explicitcache'), 1)
+            checkpoint_changes.set_parm(dopnet.parm('explicitcachename'), directory_manager.build_checkpoint_path(render_node, dopnet))
+            checkpoint_changes.set_parm(dopnet.parm('explicitcachecheckpointspacing'), window_frames)
+            checkpoint_changes.set_parm(dopnet.parm('explicitcachensteps'), 2)
+    except (AttributeError, hou.Error) as e:
+        print("Unable to enable checkpoints on %s: %s" % (dopnet.path(), e))
+        # the sim is cached in one task, without the dopnets it got to half set up
+        checkpoint_changes.restore()
+        return False
+
+    # initializing the sim would throw away the state each window resumes from
+    if render_node.parm('initsim'):
+        checkpoint_changes.set_parm(render_node.parm('initsim'), 0)
+
+    changes.extend(checkpoint_changes)
+    return True
+
+def split_sim_windows(framelist, window_frames):
+    frames = list(SubmitHoudiniToDeadlineFunctions.iter_frame_ranges(SubmitHoudiniToDeadlineFunctions.parse_frame_ranges(framelist)))
+    return [SubmitHoudiniToDeadlineFunctions.format_frames(frames[i:i + window_frames]) for i in range(0, len(frames), window_frames)]
+
+def configure_sim_windows(render_node, jobProperties, changes):
+    sim_nodes = parm_handler.get_all_eval_nodes({'node': get_cache_sop(render_node)})
+    dopnets = get_sim_dopnets(sim_nodes or [])
+    windows = split_sim_windows(jobProperties['framelist'], SIM_WINDOW_FRAMES)
+
+    if not dopnets or len(windows) < 2 or not enable_sim_checkpoints(render_node, dopnets, SIM_WINDOW_FRAMES, changes):
+        print("%s is a simulation, caching it in a single task" % render_node.path())
+        return
+
+    jobProperties['simwindows'] = windows
+    jobProperties['batch'] = True
+    print("%s is a simulation, caching it in %s windows resuming from checkpoints" % (render_node.path(), len(windows)))
+
+def configure_cache_sharding(render_node, jobProperties, changes):
+    # frame independent caches are sharded over several machines, simulations are split into sequential windows
+    if is_frame_independent(render_node):
+        jobProperties['framespertask'] = get_cache_chunk_size(render_node, jobProperties)
+        # tasks are sized from how long previous caches of this ROP took, but never bigger than a shard
+        jobProperties['maxframespertask'] = jobProperties['framespertask']
+        jobProperties['adaptivechunksize'] = 1
+        print("Sharding %s into tasks of at most %s frames" % (render_node.path(), jobProperties['framespertask']))
+    else:
+        # a simulation's frames depend on each other, how long they took says nothing about how to split them
+        jobProperties['adaptivechunksize'] = 0
+        configure_sim_windows(render_node, jobProperties, changes)
+
+def submit_cache_job(render_node, jobProperties):
+    windows = jobProperties.get('simwindows')
+    if not windows:
+        return SubmitHoudiniToDeadlineFunctions.SubmitRenderJob(render_node, jobProperties, "")
+
+    # every window waits for the previous one, whose last checkpoint it resumes from
+    job_ids = []
+    dependencies = ""
+    for window in windows:
+        window_properties = dict(jobProperties, framelist=window, comment="Simulation frames %s" % window)
+        window_ids = SubmitHoudiniToDeadlineFunctions.SubmitRenderJob(render_node, window_properties, dependencies)
+        dependencies = ",".join(window_ids)
+        job_ids.extend(window_ids)
+
+    return job_ids
+
+
+def save_farm_scene():
+    # the farm loads a copy saved next to the artist's scene, so $HIP stays the same and the changes made for the
+    # farm never end up in the artist's hip
+    hip_path = hou.hipFile.path()
+    root, ext = os.path.splitext(hip_path)
+    farm_path = "%s_farm_%s%s" % (root, time.strftime("%Y%m%d_%H%M%S"), ext)
+    hou.hipFile.save(farm_path, save_to_recent_files=False)
+    hou.hipFile.setName(hip_path)
+    return farm_path
+
+
+def run_job_cmd(render_node, jobProperties=None, framelist=None, changes=None):
+    # changes are what the caller set up on the scene for the farm, put back along with this job's once it's submitted.
+    # a caller passing changes has asked the artist to save before making them
+    if changes is None:
+        if not SubmitHoudiniToDeadlineFunctions.SaveScene():
+            return None
+        changes = directory_manager.SceneChanges()
+
+    try:
+        if jobProperties is None:
+            jobProperties = create_job_dict(render_node)
+            # only cache these frames instead of the node's frame range, ie. to fill gaps found by verify_cache
+            if framelist:
+                jobProperties['framelist'] = framelist
+            # the machine limit from the storage rules decides how far frame independent caches can be sharded
+            io_limits.configure_io_limits(render_node, jobProperties)
+            # sharding may set up sim checkpoints on the scene, so it has to happen before the scene is saved for the farm
+            configure_cache_sharding(render_node, jobProperties, changes)
+
+        # so are the post frame scripts making frames appear complete or not at all
+        atomic_writes = jobProperties.get('atomicwrites') and directory_manager.enable_atomic_writes(render_node, changes)
+        if atomic_writes:
+            if not jobProperties.get('simwindows'):
+                # a frame of an upstream cache is there once its task is done, so tasks can wait for their own frames
+                # rather than the whole job. sim windows wait for the whole previous window
+                jobProperties['isframedependent'] = 1
+        else:
+            # left over from an older submission
+            changes.set_user_data(render_node, directory_manager.ATOMIC_WRITES_KEY, None)
+        # and so is the post render script waiting for frames written to scratch to be uploaded
+        if jobProperties.get('localwrites'):
+            directory_manager.enable_local_writes(render_node, changes)
+        else:
+            changes.set_user_data(render_node, directory_manager.LOCAL_WRITES_KEY, None)
+
+        jobProperties['scenefile'] = save_farm_scene()
+        return submit_to_deadline(render_node, jobProperties)
+    finally:
+        # the farm loads the saved scene, the artist's session goes back to how it was
+        changes.restore()
 
-    SubmitHoudiniToDeadlineFunctions.SaveScene()
 
-    jobProperties = create_job_dict(render_node)
+def submit_to_deadline(render_node, jobProperties):
 
     ## submit to Deadline ##
     flag = 0
@@ -205,7 +389,8 @@ def run_job_cmd(render_node):
 
     if flag:
         try:
-            jobIds = SHTDFunctions.SubmitRenderJob( render_node, jobProperties, "")
+            with SHTDFunctions.submission_cache():
+                jobIds = submit_cache_job(render_node, jobProperties)
         except Exception as e:
             print(e)
             hou.ui.displayMessage("Can`t submit to Deadline Repo.")
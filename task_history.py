@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local history of how long Deadline tasks took per (hip file, ROP path, renderer), used to recommend chunk sizes
+so tasks land in a target duration window.
+
+Submitted job ids are recorded when jobs are submitted. The next time a chunk size is needed for the same ROP,
+the finished tasks of those jobs are queried with deadlinecommand and folded into the history, which is kept in
+a small SQLite file in the Deadline user settings folder.
+"""
+from __future__ import print_function
+
+import json
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+try:
+    from CallDeadlineCommand import CallDeadlineCommand
+except ImportError:
+    from SubmitHoudiniToDeadlineFunctions import CallDeadlineCommand
+
+HISTORY_FILE_NAME = "houdini_task_history.sqlite"
+
+# Jobs which are still not finished after this long are dropped rather than queried forever.
+MAX_PENDING_JOB_AGE = 30 * 24 * 60 * 60
+# deadlinecommand is run once per pending job while a job is being submitted, so only this many of the oldest are
+# queried per submission. The rest are collected by later submissions.
+MAX_COLLECTED_JOBS = 5
+# Only the most recent samples are used so the history follows changes to the scene.
+MAX_SAMPLES = 200
+MIN_SAMPLES = 3
+
+DEFAULT_TARGET_MINUTES = ( 10, 20 )
+
+DURATION_REGEX = re.compile( r"^(?:([0-9]+)[.:])?([0-9]+):([0-9]+):([0-9]+(?:\.[0-9]+)?)$" )
+
+def get_history_path():
+    """
+    :return: The path of the history file, in the Deadline user settings folder when known
+    """
+    homeDir = ""
+    try:
+        import hou
+        homeDir = json.loads( hou.getenv( "Deadline_Submission_Info" ) )[ "UserHomeDir" ].strip()
+    except Exception:
+        pass
+
+    if not homeDir:
+        homeDir = os.path.join( os.path.expanduser( "~" ), ".deadline" )
+
+    settingsDir = os.path.join( homeDir, "settings" )
+    if not os.path.isdir( settingsDir ):
+        os.makedirs( settingsDir )
+
+    return os.path.join( settingsDir, HISTORY_FILE_NAME )
+
+def connect( historyPath=None ):
+    connection = sqlite3.connect( historyPath or get_history_path(), timeout=10 )
+    connection.execute( "CREATE TABLE IF NOT EXISTS jobs ( job_id TEXT PRIMARY KEY, hip TEXT, rop TEXT, renderer TEXT, submitted REAL )" )
+    connection.execute( "CREATE TABLE IF NOT EXISTS samples ( hip TEXT, rop TEXT, renderer TEXT, frames INTEGER, seconds REAL, recorded REAL )" )
+    connection.execute( "CREATE INDEX IF NOT EXISTS samples_key ON samples ( hip, rop, renderer )" )
+    connection.execute( "CREATE INDEX IF NOT EXISTS jobs_key ON jobs ( hip, rop, renderer )" )
+    return connection
+
+def record_job( jobId, hip, rop, renderer, historyPath=None ):
+    """
+    Remembers a submitted job so its task timings can be collected once it has finished.
+    """
+    if not jobId:
+        return
+
+    connection = connect( historyPath )
+    try:
+        with connection:
+            connection.execute( "INSERT OR REPLACE INTO jobs VALUES ( ?, ?, ?, ?, ? )", ( jobId, hip, rop, renderer, time.time() ) )
+    finally:
+        connection.close()
+
+def count_frames( frameList ):
+    """
+    :param frameList: A Deadline task frame list, ie. "1-10" or "1-10x2,15"
+    :return: The number of frames in the list
+    """
+    from SubmitHoudiniToDeadlineFunctions import count_frame_ranges, parse_frame_ranges
+
+    try:
+        return count_frame_ranges( parse_frame_ranges( str( frameList ) ) )
+    except ValueError:
+        return 0
+
+def parse_duration( value ):
+    """
+    :param value: A duration in seconds, or formatted as [d.]hh:mm:ss[.ff]
+    :return: The duration in seconds, or None if it can't be parsed
+    """
+    if isinstance( value, ( int, float ) ):
+        return float( value )
+
+    match = DURATION_REGEX.match( str( value ).strip() )
+    if match is None:
+        return None
+
+    days = int( match.group( 1 ) or 0 )
+    return days * 86400 + int( match.group( 2 ) ) * 3600 + int( match.group( 3 ) ) * 60 + float( match.group( 4 ) )
+
+def parse_timestamp( value ):
+    try:
+        return datetime.strptime( str( value )[:19], "%Y-%m-%dT%H:%M:%S" )
+    except ValueError:
+        return None
+
+def get_task_seconds( task ):
+    """
+    :param task: A task as returned by deadlinecommand
+    :return: How long the task rendered for, in seconds, or None if it isn't known
+    """
+    for key in ( "TaskRenderTime", "RenderTime", "RndTime" ):
+        if key in task:
+            seconds = parse_duration( task[ key ] )
+            if seconds:
+                return seconds
+
+    started = parse_timestamp( task.get( "StartRen", task.get( "TaskStartTime", "" ) ) )
+    completed = parse_timestamp( task.get( "Comp", task.get( "TaskCompletedTime", "" ) ) )
+    if started and completed and completed > started:
+        delta = completed - started
+        return delta.days * 86400 + delta.seconds
+
+    return None
+
+def is_task_completed( task ):
+    status = task.get( "Stat", task.get( "TaskStatus", task.get( "Status", "" ) ) )
+    return status == 5 or str( status ).lower() == "completed"
+
+def query_job_tasks( jobId ):
+    """
+    :return: The job's tasks as dictionaries, or None if Deadline couldn't be queried
+    """
+    try:
+        output = json.loads( CallDeadlineCommand( [ "-prettyJSON", "-GetJobTasks", jobId ] ) )
+    except ValueError:
+        return None
+
+    if not output.get( "ok" ):
+        return None
+
+    return output.get( "result" ) or []
+
+def collect_finished_jobs( hip, rop, renderer, connection ):
+    """
+    Folds the timings of finished jobs previously submitted for the ROP into the history. At most
+    MAX_COLLECTED_JOBS jobs are queried, before the history is written to, so the history file isn't locked
+    while deadlinecommand runs. Jobs which are still rendering are left to be collected later.
+    """
+    pending = connection.execute( "SELECT job_id, submitted FROM jobs WHERE hip=? AND rop=? AND renderer=? ORDER BY submitted LIMIT ?", ( hip, rop, renderer, MAX_COLLECTED_JOBS ) ).fetchall()
+    now = time.time()
+    jobTasks = [ ( jobId, submitted, query_job_tasks( jobId ) ) for jobId, submitted in pending ]
+
+    with connection:
+        for jobId, submitted, tasks in jobTasks:
+            if tasks is None:
+                # The job may have been deleted, or Deadline is unavailable
+                if now - submitted > MAX_PENDING_JOB_AGE:
+                    connection.execute( "DELETE FROM jobs WHERE job_id=?", ( jobId, ) )
+                continue
+
+            if not all( is_task_completed( task ) for task in tasks ) and now - submitted < MAX_PENDING_JOB_AGE:
+                continue
+
+            for task in tasks:
+                if not is_task_completed( task ):
+                    continue
+
+                frames = count_frames( task.get( "Frames", task.get( "TaskFrameList", "" ) ) )
+                seconds = get_task_seconds( task )
+                if frames and seconds:
+                    connection.execute( "INSERT INTO samples VALUES ( ?, ?, ?, ?, ?, ? )", ( hip, rop, renderer, frames, seconds, now ) )
+
+            connection.execute( "DELETE FROM jobs WHERE job_id=?", ( jobId, ) )
+
+def get_seconds_per_frame( hip, rop, renderer, connection ):
+    """
+    :return: The median seconds per frame of the ROP's most recent tasks, or None if there isn't enough history
+    """
+    rows = connection.execute( "SELECT frames, seconds FROM samples WHERE hip=? AND rop=? AND renderer=? ORDER BY recorded DESC LIMIT ?", ( hip, rop, renderer, MAX_SAMPLES ) ).fetchall()
+    if len( rows ) < MIN_SAMPLES:
+        return None
+
+    secondsPerFrame = sorted( seconds / frames for frames, seconds in rows )
+    return secondsPerFrame[ len( secondsPerFrame ) // 2 ]
+
+def get_recorded_seconds_per_frame( hip, rop, renderer, historyPath=None ):
+    """
+    Collects the ROP's finished jobs into the history and returns how long it takes to render a frame.
+    :return: The median seconds per frame of the ROP's most recent tasks, or None if there isn't enough history
+    """
+    connection = connect( historyPath )
+    try:
+        collect_finished_jobs( hip, rop, renderer, connection )
+        return get_seconds_per_frame( hip, rop, renderer, connection )
+    finally:
+        connection.close()
+
+def recommend_chunk_size( hip, rop, renderer, frameCount, targetMinutes=DEFAULT_TARGET_MINUTES, historyPath=None ):
+    """
+    Recommends how many frames each task should render so tasks take between the target minimum and maximum
+    minutes, aiming for the middle of the window.
+    :param hip: The path of the hip file
+    :param rop: The path of the ROP node
+    :param renderer: The ROP's type name
+    :param frameCount: The number of frames which will be submitted
+    :param targetMinutes: ( minimum, maximum ) task duration in minutes
+    :return: The recommended chunk size, or None if there is no history for the ROP yet
+    """
+    secondsPerFrame = get_recorded_seconds_per_frame( hip, rop, renderer, historyPath )
+    if not secondsPerFrame:
+        return None
+
+    minSeconds, maxSeconds = targetMinutes[ 0 ] * 60.0, targetMinutes[ 1 ] * 60.0
+    chunkSize = int( round( ( minSeconds + maxSeconds ) / 2.0 / secondsPerFrame ) )
+    # Frames slower than the whole window can't be grouped, so they get a task each
+    chunkSize = max( 1, min( chunkSize, int( maxSeconds // secondsPerFrame ) or 1 ) )
+
+    print( "Task history: %.1f seconds per frame for %s, recommending %s frames per task" % ( secondsPerFrame, rop, chunkSize ) )
+    return min( chunkSize, max( frameCount, 1 ) )
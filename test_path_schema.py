@@ -0,0 +1,32 @@
+import sys
+import types
+import unittest
+
+# path_schema only needs hou to expand $VARIABLES, which these templates don't have
+if 'hou' not in sys.modules:
+    sys.modules['hou'] = types.ModuleType('hou')
+
+import path_schema
+
+
+class SplitAtFrameTest(unittest.TestCase):
+    def check_template(self, template):
+        schema = path_schema.PathSchema(template)
+        fields = {'hip': '/show/shot', 'name': 'pig', 'version': 3}
+        prefix, suffix, padding = schema.split_at_frame(**fields)
+        for frame in (1, 7, 42, 1001, 12345):
+            self.assertEqual(prefix + str(frame).zfill(padding) + suffix, schema.format(frame=frame, **fields))
+
+    def test_unpadded(self):
+        self.check_template(path_schema.DEFAULT_TEMPLATE)
+
+    def test_padded(self):
+        self.check_template("{hip}/cache/{name}/v{version:3}/{name}.v{version:3}.{frame:4}.{ext}")
+
+    def test_no_frame_token(self):
+        with self.assertRaises(ValueError):
+            path_schema.PathSchema("{hip}/geo/{name}/v{version}/{name}.{ext}").split_at_frame(hip='/show', name='pig', version=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cost balanced tile regions for tile renders.
+
+The points of the visible geometry are projected through the render camera, the same way Jigsaw's
+getSelectedBoundingRegion maps them to the screen, and counted in a screen space grid. The grid is then split
+recursively so every region covers roughly the same number of points, which stands in for render cost: regions
+over dense geometry such as hair end up small, regions over sky end up large.
+"""
+from __future__ import print_function
+
+import hou
+
+# Cells per side of the screen space cost map
+COST_MAP_RESOLUTION = 64
+# Objects with more points than this are sampled, every sample weighted by the points it stands for
+MAX_SAMPLED_POINTS = 200000
+# Share of the average cell cost every cell gets, so empty areas such as sky still cost something to render
+BASE_COST_FRACTION = 0.05
+
+class CameraProjection( object ):
+    """
+    Maps world space positions to normalized screen coordinates of a camera at a given frame,
+    with ( 0, 0 ) at the bottom left of the image and ( 1, 1 ) at the top right.
+    """
+    def __init__( self, cameraNode, frame ):
+        self.worldToCamera = cameraNode.worldTransformAtTime( hou.frameToTime( frame ) ).inverted()
+
+        resx = cameraNode.parm( "resx" ).evalAtFrame( frame )
+        resy = cameraNode.parm( "resy" ).evalAtFrame( frame )
+        pixelAspect = cameraNode.parm( "aspect" ).evalAtFrame( frame ) if cameraNode.parm( "aspect" ) else 1.0
+        self.imageAspect = resx * pixelAspect / float( resy )
+
+        self.ortho = cameraNode.parm( "projection" ) is not None and cameraNode.parm( "projection" ).evalAsStringAtFrame( frame ) == "ortho"
+        if self.ortho:
+            self.width = cameraNode.parm( "orthowidth" ).evalAtFrame( frame )
+        else:
+            self.width = cameraNode.parm( "aperture" ).evalAtFrame( frame ) / cameraNode.parm( "focal" ).evalAtFrame( frame )
+        self.height = self.width / self.imageAspect
+
+        self.window = [ 0.0, 0.0, 1.0, 1.0 ]
+        for index, parmName in enumerate( ( "winx", "winy", "winsizex", "winsizey" ) ):
+            if cameraNode.parm( parmName ):
+                self.window[ index ] = cameraNode.parm( parmName ).evalAtFrame( frame )
+
+    def project( self, x, y, z ):
+        """
+        :param x, y, z: A position in camera space
+        :return: The normalized screen position, or None if the position is behind the camera
+        """
+        if self.ortho:
+            screenX, screenY = x / self.width, y / self.height
+        else:
+            if z >= 0.0:
+                return None
+            screenX, screenY = x / -z / self.width, y / -z / self.height
+
+        return ( ( screenX - self.window[ 0 ] ) / self.window[ 2 ] + 0.5, ( screenY - self.window[ 1 ] ) / self.window[ 3 ] + 0.5 )
+
+def get_visible_objects( rop ):
+    """
+    :return: The displayed geometry objects the ROP renders, limited by its candidate objects if it has them
+    """
+    objects = hou.node( "/obj" ).allSubChildren()
+    if rop.parm( "vobject" ) is not None:
+        pattern = rop.parm( "vobject" ).evalAsString()
+        objects = hou.node( "/obj" ).glob( pattern ) if pattern else []
+
+    return [ obj for obj in objects if obj.type().name() == "geo" and obj.isObjectDisplayed() and obj.displayNode() is not None ]
+
+def get_object_geometry( obj, frame ):
+    sop = obj.displayNode()
+    if hasattr( sop, "geometryAtFrame" ):
+        return sop.geometryAtFrame( frame )
+    return sop.geometry()
+
+def add_object_cost( costMap, obj, projection, frame ):
+    """
+    Counts the object's points, projected to the screen, into the cells of the cost map.
+    """
+    geometry = get_object_geometry( obj, frame )
+    if geometry is None:
+        return
+
+    positions = geometry.pointFloatAttribValues( "P" )
+    pointCount = len( positions ) // 3
+    if pointCount == 0:
+        return
+
+    stride = max( 1, pointCount // MAX_SAMPLED_POINTS )
+    weight = float( stride )
+
+    # Row vector convention, as used by hou.Vector3 * hou.Matrix4
+    m = ( obj.worldTransformAtTime( hou.frameToTime( frame ) ) * projection.worldToCamera ).asTuple()
+    resolution = len( costMap )
+
+    for index in range( 0, pointCount * 3, stride * 3 ):
+        x, y, z = positions[ index ], positions[ index + 1 ], positions[ index + 2 ]
+        screen = projection.project( x * m[0] + y * m[4] + z * m[8] + m[12], x * m[1] + y * m[5] + z * m[9] + m[13], x * m[2] + y * m[6] + z * m[10] + m[14] )
+        if screen is None or not ( 0.0 <= screen[ 0 ] < 1.0 and 0.0 <= screen[ 1 ] < 1.0 ):
+            continue
+
+        costMap[ int( screen[ 1 ] * resolution ) ][ int( screen[ 0 ] * resolution ) ] += weight
+
+def build_cost_map( rop, cameraNode, frame, resolution=COST_MAP_RESOLUTION ):
+    """
+    :return: A resolution x resolution grid of costs, indexed [ row from the bottom ][ column from the left ],
+             and the camera projection used, or ( None, None ) if no visible geometry is in view
+    """
+    projection = CameraProjection( cameraNode, frame )
+    costMap = [ [ 0.0 ] * resolution for _ in range( resolution ) ]
+
+    for obj in get_visible_objects( rop ):
+        add_object_cost( costMap, obj, projection, frame )
+
+    totalCost = sum( sum( row ) for row in costMap )
+    if totalCost == 0.0:
+        return None, None
+
+    baseCost = totalCost / ( resolution * resolution ) * BASE_COST_FRACTION
+    return [ [ cost + baseCost for cost in row ] for row in costMap ], projection
+
+class CostMapRegions( object ):
+    """
+    Splits a cost map into regions of roughly equal cost, using summed area tables so the cost of any region
+    is found in constant time.
+    """
+    def __init__( self, costMap, imageAspect=1.0 ):
+        self.resolution = len( costMap )
+        self.imageAspect = imageAspect
+
+        self.summed = [ [ 0.0 ] * ( self.resolution + 1 ) for _ in range( self.resolution + 1 ) ]
+        for row in range( self.resolution ):
+            rowSum = 0.0
+            for column in range( self.resolution ):
+                rowSum += costMap[ row ][ column ]
+                self.summed[ row + 1 ][ column + 1 ] = self.summed[ row ][ column + 1 ] + rowSum
+
+    def cost( self, x0, x1, y0, y1 ):
+        return self.summed[ y1 ][ x1 ] - self.summed[ y0 ][ x1 ] - self.summed[ y1 ][ x0 ] + self.summed[ y0 ][ x0 ]
+
+    def split( self, regionCount ):
+        """
+        :return: Up to regionCount ( x0, x1, y0, y1 ) regions in cells, covering the whole map
+        """
+        return self.split_region( 0, self.resolution, 0, self.resolution, regionCount )
+
+    def split_region( self, x0, x1, y0, y1, regionCount ):
+        width, height = x1 - x0, y1 - y0
+        if regionCount <= 1 or ( width < 2 and height < 2 ):
+            return [ ( x0, x1, y0, y1 ) ]
+
+        firstCount = regionCount // 2
+        target = self.cost( x0, x1, y0, y1 ) * firstCount / float( regionCount )
+
+        # Cut across the longer side on screen, at the cell boundary closest to the target cost
+        if ( width * self.imageAspect >= height and width >= 2 ) or height < 2:
+            cut = min( range( x0 + 1, x1 ), key=lambda c: abs( self.cost( x0, c, y0, y1 ) - target ) )
+            first, second = ( x0, cut, y0, y1 ), ( cut, x1, y0, y1 )
+        else:
+            cut = min( range( y0 + 1, y1 ), key=lambda c: abs( self.cost( x0, x1, y0, c ) - target ) )
+            first, second = ( x0, x1, y0, cut ), ( x0, x1, cut, y1 )
+
+        return self.split_region( *( first + ( firstCount, ) ) ) + self.split_region( *( second + ( regionCount - firstCount, ) ) )
+
+def get_cost_balanced_regions( rop, regionCount, frame ):
+    """
+    :param rop: The ROP rendered in tiles, which has a camera parameter
+    :param regionCount: The number of regions wanted
+    :param frame: The frame the geometry is evaluated at
+    :return: Regions as a flat list of normalized xstart, xend, ystart, yend values, as the jigsawregions job property
+             holds them, or None if there is no geometry in view to balance by
+    """
+    if rop.parm( "camera" ) is None:
+        return None
+
+    cameraNode = hou.node( rop.parm( "camera" ).eval() )
+    if cameraNode is None:
+        return None
+
+    costMap, projection = build_cost_map( rop, cameraNode, frame )
+    if costMap is None:
+        return None
+
+    resolution = float( len( costMap ) )
+    regions = []
+    for x0, x1, y0, y1 in CostMapRegions( costMap, projection.imageAspect ).split( regionCount ):
+        regions.extend( [ x0 / resolution, x1 / resolution, y0 / resolution, y1 / resolution ] )
+
+    return regions
@@ -0,0 +1,77 @@
+import os
+import cache_index
+import directory_manager
+import send_job
+import SubmitHoudiniToDeadlineFunctions
+
+# frames smaller than this share of the median frame size are probably truncated
+SUSPECT_SIZE_RATIO = 0.25
+
+
+def get_expected_frames(render_node):
+    start = int(render_node.evalParm("f1"))
+    end = int(render_node.evalParm("f2"))
+    step = int(render_node.evalParm("f3")) if render_node.parm("f3") else 1
+    return list(range(start, end + 1, max(1, step)))
+
+def verify_version(render_node, version=None):
+    # compares the node's frame range against what's on disk for a version, the cache version by default,
+    # and returns the missing, empty and suspiciously small frames
+    if version is None:
+        version = int(render_node.evalParm("cacheversion"))
+
+    version_dir = directory_manager.get_cache_version_dir(render_node, version)
+    frames = cache_index.scan_version_frames(version_dir, render_node.name(), version) if os.path.isdir(version_dir) else {}
+
+    expected = get_expected_frames(render_node)
+    missing = [x for x in expected if x not in frames]
+    empty = [x for x in expected if x in frames and frames[x][0] == 0]
+
+    sizes = sorted(frames[x][0] for x in expected if x in frames and frames[x][0] > 0)
+    small = []
+    if sizes:
+        median = sizes[len(sizes) // 2]
+        small = [x for x in expected if x in frames and 0 < frames[x][0] < median * SUSPECT_SIZE_RATIO]
+
+    return {
+        'version': version,
+        'missing': missing,
+        'empty': empty,
+        'small': small,
+        'bad': sorted(set(missing + empty + small)),
+    }
+
+def build_frame_list(frames):
+    # the shortest Deadline frame list covering the frames, ie. 4, 5, 6, 20 -> 4-6,20
+    return SubmitHoudiniToDeadlineFunctions.format_frames(sorted(frames))
+
+def report(render_node, result):
+    print("%s v%s: %s missing, %s empty, %s suspiciously small frames" % (render_node.path(), result['version'], len(result['missing']), len(result['empty']), len(result['small'])))
+    if result['bad']:
+        print("Frames to recache: %s" % build_frame_list(result['bad']))
+
+def resubmit_bad_frames(render_node, version=None):
+    # verifies a cache version and submits only the frames that need to be cached again
+    result = verify_version(render_node, version)
+    report(render_node, result)
+
+    if not result['bad']:
+        return None
+
+    # the job caches to the node's current version, so only that version can be repaired
+    if result['version'] != int(render_node.evalParm("cacheversion")):
+        print("Set the cache version of %s to %s to recache its bad frames" % (render_node.path(), result['version']))
+        return None
+
+    return send_job.run_job_cmd(render_node, framelist=build_frame_list(result['bad']))
+
+def pack_if_complete(render_node, version=None, keep_frames=False):
+    # the step after a cache has finished: a version is only packed once none of its frames need caching again
+    result = verify_version(render_node, version)
+    report(render_node, result)
+
+    if result['bad']:
+        print("Not packing %s v%s until its bad frames are cached again" % (render_node.path(), result['version']))
+        return None
+
+    return directory_manager.pack_cache_version(render_node, result['version'], keep_frames)
@@ -0,0 +1,121 @@
+import itertools
+import os
+from pprint import pformat
+import hou
+import SubmitHoudiniToDeadlineFunctions
+import directory_manager
+import io_limits
+import send_job
+
+
+def build_variants(grid=None, variants=None):
+    # an explicit list of {parm: value} dicts, or every combination of a {parm: [values]} grid
+    if variants is not None:
+        return [dict(x) for x in variants]
+
+    parm_names = sorted(grid)
+    return [dict(zip(parm_names, values)) for values in itertools.product(*[grid[x] for x in parm_names])]
+
+def find_parm_tuple(cache_node, parm_name):
+    # parms can be given by name on the cache node, or by path like parm_handler lists them
+    parm = hou.parm(parm_name) if '/' in parm_name else cache_node.parm(parm_name)
+    parm_tuple = parm.tuple() if parm else cache_node.parmTuple(parm_name)
+
+    if parm_tuple is None:
+        raise hou.OperationFailed("%s has no parameter %s" % (cache_node.path(), parm_name))
+
+    return parm, parm_tuple
+
+def set_variant_parm(cache_node, parm_name, value):
+    parm, parm_tuple = find_parm_tuple(cache_node, parm_name)
+    if isinstance(value, (list, tuple)):
+        parm_tuple.set(value)
+    else:
+        (parm or parm_tuple[0]).set(value)
+
+def write_variant_settings(cache_node, variant):
+    # the settings go into the version folder, where get_txt_file looks for them when reviewing a version
+    settings_file = os.path.join(directory_manager.create_directory(cache_node), "cache_settings.txt")
+    with open(settings_file, "w") as f:
+        f.write(pformat(variant))
+
+def create_variant_takes(cache_node, variants, root_take_name, changes):
+    # every variant gets a child take of the root take holding its parm overrides and its own cache version
+    original_take = hou.takes.currentTake()
+    root_take = original_take.addChildTake(root_take_name)
+    changes.add_undo(lambda: root_take.destroy(recurse_children=True))
+    first_version = directory_manager.get_next_cache_version(cache_node)
+
+    try:
+        for i, variant in enumerate(variants):
+            version = first_version + i
+            take = root_take.addChildTake("%s_v%s" % (root_take_name, version))
+            hou.takes.setCurrentTake(take)
+
+            take.addParmTuple(cache_node.parmTuple("cacheversion"))
+            cache_node.parm("cacheversion").set(version)
+
+            for parm_name, value in variant.items():
+                take.addParmTuple(find_parm_tuple(cache_node, parm_name)[1])
+                set_variant_parm(cache_node, parm_name, value)
+
+            write_variant_settings(cache_node, variant)
+            print("Wedge variant %s caches to version %s: %s" % (i, version, variant))
+    finally:
+        hou.takes.setCurrentTake(original_take)
+
+    return root_take, first_version
+
+def create_wedge_node(cache_node, root_take, changes):
+    wedge_node = hou.node("/out").createNode("wedge", root_take.name())
+    changes.add_undo(wedge_node.destroy)
+    wedge_node.parm("driver").set(cache_node.path())
+    wedge_node.parm("wedgemethod").set("take")
+    wedge_node.parm("roottake").set(root_take.name())
+    return wedge_node
+
+def submit_wedge(cache_node, grid=None, variants=None):
+    """
+    Submits variants of a cache node as the tasks of a single Deadline job.
+    Pass either a grid of {parm: [values]} to cache every combination, or an explicit list of {parm: value} dicts.
+    Every variant caches to its own version. Its parm overrides live in a take driven by a Wedge ROP, so the
+    scene is only saved and submitted once. The takes and the Wedge ROP are only in the scene the farm loads,
+    they're removed from the session again once the job is submitted.
+    """
+    variants = build_variants(grid, variants)
+    if not variants:
+        print("No wedge variants to submit for %s" % cache_node.path())
+        return None
+
+    # the artist's own edits go into their scene before anything is set up for the farm
+    if not SubmitHoudiniToDeadlineFunctions.SaveScene():
+        return None
+
+    changes = directory_manager.SceneChanges()
+    try:
+        root_take, first_version = create_variant_takes(cache_node, variants, "wedge_" + cache_node.name(), changes)
+        wedge_node = create_wedge_node(cache_node, root_take, changes)
+
+        # one task per variant, each caching the whole frame range of the cache node
+        jobProperties = send_job.create_job_dict(cache_node)
+        jobProperties['jobname'] = "%s - %s wedge v%s-v%s" % (jobProperties['jobname'], cache_node.name(), first_version, first_version + len(variants) - 1)
+        jobProperties['framelist'] = "0-%s" % (len(variants) - 1)
+        jobProperties['framespertask'] = 1
+        jobProperties['adaptivechunksize'] = 0
+        jobProperties['separateWedgeJobs'] = 0
+        io_limits.configure_io_limits(cache_node, jobProperties)
+
+        # the cache node writes the frames, not the wedge ROP driving it
+        if jobProperties.pop('atomicwrites', False):
+            directory_manager.enable_atomic_writes(cache_node, changes)
+        else:
+            changes.set_user_data(cache_node, directory_manager.ATOMIC_WRITES_KEY, None)
+        if jobProperties.pop('localwrites', False):
+            directory_manager.enable_local_writes(cache_node, changes)
+        else:
+            changes.set_user_data(cache_node, directory_manager.LOCAL_WRITES_KEY, None)
+
+        return send_job.run_job_cmd(wedge_node, jobProperties, changes=changes)
+    finally:
+        # run_job_cmd has put everything back already unless something failed before it
+        changes.restore()